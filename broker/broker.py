@@ -3,37 +3,123 @@ import requests
 import time
 import threading
 import logging
+import logging.handlers
+import atexit
 import socket
-import json # <-- ADDED for proper JSON handling
+import sys
 import os # <-- ADDED to check if log file exists
+import zlib
 import uuid # <-- ADDED for message IDs
+import orjson
+import lz4.frame
+import queue
+import collections
+import itertools
+import mmap
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from werkzeug.http import generate_etag
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
+
+
+# Run from the service directory; shared modules live in common/ at the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.orjson_provider import ORJSONProvider
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # ---------------- CONFIG ----------------
 FOLLOWER_URL = None  # Set to None to disable replication, or "http://192.168.191.242:5002" to enable
 BROKER_ID = f"broker-{socket.gethostname()}"
 REDIS_HOST = "192.168.191.242"
 REDIS_PORT = 6379
+REDIS_DB = 0
+REDIS_MAX_CONNECTIONS = 64
 LEASE_TIME_SECONDS = 10
 RENEW_INTERVAL_SECONDS = 5
 PORT = 5001
 LOG_FILE = f"{BROKER_ID}_log.txt"
+LOG_WRITER_BATCH_SIZE = 512  # Max records appended per log writer wakeup
+LOG_WRITER_LINGER_SECONDS = 0.0  # Extra time to wait for more records per batch (e.g. 0.002 under concurrent producers)
+COMMIT_MAX_BATCHES = 8  # Max appended batches merged into one replication + HWM commit
+LOG_WRITER_BUFFER_BYTES = 512 << 10  # Size of the log writer's page-aligned staging buffer
+# "async": a record is committed once it is in the page cache (fast; may be lost on power loss)
+# "sync": each batch is fdatasync'ed before its HWM advances (one sync per partition per batch)
+DURABILITY = "async"
+COMMIT_TIMEOUT_SECONDS = 10  # How long a produce request waits for its batch to commit
+REPLICATION_TIMEOUT_SECONDS = 3
+REPLICATION_COMPRESS_MIN_BYTES = 256  # Replication bodies larger than this are LZ4-compressed
+FOLLOWER_HEALTH_TTL_SECONDS = 2.0  # /metrics may report follower health this stale
+SNAPSHOT_INTERVAL_SECONDS = 0.5  # How often the /metrics and /health bodies are rebuilt
+LEADER_CACHE_TTL_SECONDS = 0.5  # /metadata/leader and redirects may report the leader this stale
 
 # ---------------- LOGGING ----------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Request threads only enqueue log records; formatting and the stderr write
+# happen on the QueueListener's thread
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+LOG_LISTENER = logging.handlers.QueueListener(queue.SimpleQueue(), _log_handler)
+_queue_handler = logging.handlers.QueueHandler(LOG_LISTENER.queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))  # The listener adds time and level
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)
 logger = logging.getLogger(__name__)
 
 # ---------------- GLOBAL STATE ----------------
 IS_LEADER = False
-LEASE_RENEWAL_THREAD = None
+NEXT_RENEWAL_AT = None  # time.monotonic() of the next lease renewal while we're leader
 
 # Topic and Partition Management
-TOPICS = {}  # {topic_name: {partition_id: log_file_path}}
+TOPICS = {}  # {topic_name: (log_file_path of partition 0, partition 1, ...)}
 DEFAULT_PARTITIONS = 3  # Default number of partitions per topic
 
+# Encoded records waiting to be appended, replicated and committed by the log writer thread
+LOG_QUEUE = queue.SimpleQueue()  # items: ((topic, partition_id), log_file_path, record_bytes, Future[offset])
+
+# Batches appended by the log writer, waiting to be replicated and committed (in order)
+COMMIT_QUEUE = queue.SimpleQueue()  # items: [((topic, partition_id), [(record_bytes, Future[offset])])]
+
+# Keep-alive connections to the follower, reused by every replication batch
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+# Replication batches are length-prefixed per partition (see frame_replication_batch)
+REPLICATION_HEADERS = {"Content-Type": "application/x-yak-batch"}
+REPLICATION_LZ4_HEADERS = {**REPLICATION_HEADERS, "Content-Encoding": "lz4"}
+CONSUME_STREAM_RECORDS = 256  # Records sliced out of the log per chunk of a streamed /consume
+MAX_CONSUME_WAIT_MS = 25000  # Upper bound on a /consume long poll (wait_ms)
+
+# Last follower /health probe, refreshed by the snapshot thread when older than the TTL
+FOLLOWER_HEALTH = {"status": "Unknown", "checked_at": 0.0, "refreshing": False}
+HEALTH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# Committed HWM per partition as last advanced by this broker's committer, so
+# /consume needs no Redis read; re-seeded from Redis whenever we become leader
+HWM = {}  # {(topic, partition_id): high_water_mark}
+HWM_ADVANCED = threading.Condition()  # Notified by the committer whenever HWMs move
+
+# Last leader_lease value read for /metadata/leader and not-leader replies
+LEADER_CACHE = {"leader_id": None, "checked_at": float("-inf")}
+
+# Pre-encoded /metrics and /health responses, rebuilt by the snapshot thread
+SNAPSHOTS = {}  # {"metrics": (body_bytes, status), "health": (body_bytes, status)}
+SNAPSHOT_LOCK = threading.Lock()
+
+# Offset index: LOG_INDEX[path][i] is the byte position where record i starts,
+# and the last entry is the end of the last record written.
+# Kept as a packed array('Q') (8 bytes per record instead of a boxed int each) and
+# persisted next to each log as "<log>.idx": the raw array buffer without the leading 0.
+LOG_INDEX = {}  # {log_file_path: array("Q", [0, end_of_record_0, end_of_record_1, ...])}
+LOG_INDEX_LOCK = threading.Lock()
+
+# Read-only mappings of partition logs shared by /consume, remapped only when a log grows.
+# Replaced mappings are not closed explicitly: a request may still be slicing one.
+LOG_MMAPS = {}  # {log_file_path: mmap}
+LOG_MMAP_LOCK = threading.Lock()
+
 # Metrics tracking
 METRICS = {
     "messages_produced": 0,
@@ -42,48 +128,147 @@ METRICS = {
     "elections_won": 0,
     "leadership_changes": 0,
     "last_replication": None,
-    "recent_activity": [],  # Store recent activity logs
+    "recent_activity": collections.deque(maxlen=50),  # Most recent activity first
     "topics": {}  # {topic_name: {"partitions": count, "messages": count}}
 }
+METRICS_LOCK = threading.Lock()  # Request threads bump the scalar counters concurrently
+
+def bump_counter(name, n=1):
+    """Add n to a METRICS counter."""
+    with METRICS_LOCK:
+        METRICS[name] += n
+
+# [second, "HH:MM:SS"] - dashboard timestamps only change once a second
+_TS_CACHE = [0, ""]
+
+def _hhmmss():
+    now = int(time.time())
+    if now != _TS_CACHE[0]:
+        _TS_CACHE[1] = time.strftime("%H:%M:%S", time.localtime(now))
+        _TS_CACHE[0] = now
+    return _TS_CACHE[1]
 
 def add_activity_log(log_type, message):
-    """Add an activity log entry."""
-    timestamp = time.strftime("%H:%M:%S")
-    METRICS["recent_activity"].insert(0, {
+    """Add an activity log entry (the deque drops the oldest past 50)."""
+    METRICS["recent_activity"].appendleft({
         "type": log_type,
         "message": message,
-        "timestamp": timestamp
+        "timestamp": _hhmmss()
     })
-    # Keep only last 50 entries
-    if len(METRICS["recent_activity"]) > 50:
-        METRICS["recent_activity"].pop()
 
 def get_partition_for_key(key, num_partitions):
-    """Hash-based partition assignment."""
+    """Hash-based partition assignment, identical on every broker and restart."""
     if key is None:
         return 0
-    return hash(key) % num_partitions
+    # CRC32 is stable across restarts (hash() of str is salted per process)
+    return zlib.crc32(key if isinstance(key, bytes) else str(key).encode()) % num_partitions
 
 def ensure_topic_exists(topic_name, num_partitions=DEFAULT_PARTITIONS):
-    """Create topic with partitions if it doesn't exist."""
-    if topic_name not in TOPICS:
-        TOPICS[topic_name] = {}
-        for partition_id in range(num_partitions):
-            log_file = f"{BROKER_ID}_{topic_name}_p{partition_id}.log"
-            TOPICS[topic_name][partition_id] = log_file
-        METRICS["topics"][topic_name] = {"partitions": num_partitions, "messages": 0}
-        logger.info(f"[{BROKER_ID}] Created topic '{topic_name}' with {num_partitions} partitions")
-        add_activity_log("topic", f"Created topic '{topic_name}' with {num_partitions} partitions")
-    return TOPICS[topic_name]
+    """Create topic with partitions if it doesn't exist; returns its log paths indexed by partition id."""
+    partitions = TOPICS.get(topic_name)
+    if partitions is None:
+        # Fully built before it is published, so concurrent requests never see a partial topic
+        METRICS["topics"].setdefault(topic_name, {"partitions": num_partitions, "messages": 0})
+        log_files = tuple(f"{BROKER_ID}_{topic_name}_p{partition_id}.log" for partition_id in range(num_partitions))
+        partitions = TOPICS.setdefault(topic_name, log_files)
+        if partitions is log_files:
+            logger.info(f"[{BROKER_ID}] Created topic '{topic_name}' with {num_partitions} partitions")
+            add_activity_log("topic", f"Created topic '{topic_name}' with {num_partitions} partitions")
+    return partitions
+
+def get_log_index(log_file):
+    """Return the offset index for a partition log, loading it on first use."""
+    index = LOG_INDEX.get(log_file)
+    if index is None:
+        with LOG_INDEX_LOCK:
+            index = LOG_INDEX.get(log_file)
+            if index is None:
+                index = LOG_INDEX[log_file] = load_log_index(log_file)
+    return index
+
+def load_log_index(log_file):
+    """Load the persisted index for a log, rebuilding it from the log if it is stale."""
+    idx_file = f"{log_file}.idx"
+    log_size = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+
+    if os.path.exists(idx_file):
+        with open(idx_file, "rb") as f:
+            raw = f.read()
+        index = array("Q", [0])
+        index.frombytes(raw[:len(raw) - len(raw) % index.itemsize])
+        if index[-1] == log_size:
+            return index
+        logger.warning(f"[{BROKER_ID}] Index for {log_file} is stale, rebuilding from log")
+
+    # One scan over the log to find where each complete record ends
+    index = array("Q", [0])
+    if log_size:
+        with open(log_file, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                index.append(index[-1] + len(line))
+    with open(idx_file, "wb") as f:
+        index[1:].tofile(f)
+    return index
+
+def get_log_view(log_file, min_size):
+    """Return a read-only mmap of a partition log covering at least min_size bytes."""
+    view = LOG_MMAPS.get(log_file)
+    if view is None or len(view) < min_size:
+        with LOG_MMAP_LOCK:
+            view = LOG_MMAPS.get(log_file)
+            if view is None or len(view) < min_size:
+                with open(log_file, "rb") as f:
+                    view = LOG_MMAPS[log_file] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return view
 
 # ---------------- REDIS INIT ----------------
-try:
-    REDIS_CLIENT = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-    REDIS_CLIENT.ping()
-    logger.info(f"[{BROKER_ID}] Connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
-except redis.ConnectionError as e:
-    logger.error(f"[{BROKER_ID}] Failed to connect to Redis: {e}")
-    raise
+# One pool shared by request handlers and background threads. Connections are
+# opened lazily, so importing the module (e.g. a gunicorn worker boot) never
+# waits on Redis; start_background_threads() checks connectivity.
+REDIS_POOL = redis.ConnectionPool(
+    host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS
+)
+REDIS_CLIENT = redis.Redis(connection_pool=REDIS_POOL)
+
+
+def check_redis_connection():
+    """Fail fast (and loudly) if Redis is unreachable."""
+    try:
+        REDIS_CLIENT.ping()
+        logger.info(f"[{BROKER_ID}] Connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
+    except redis.ConnectionError as e:
+        logger.error(f"[{BROKER_ID}] Failed to connect to Redis: {e}")
+        raise
+
+
+def get_cached_leader():
+    """Return the current leader id (or None), re-reading Redis at most every LEADER_CACHE_TTL_SECONDS."""
+    now = time.monotonic()
+    if now - LEADER_CACHE["checked_at"] >= LEADER_CACHE_TTL_SECONDS:
+        LEADER_CACHE["leader_id"] = REDIS_CLIENT.get("leader_lease")
+        LEADER_CACHE["checked_at"] = now
+    return LEADER_CACHE["leader_id"]
+
+
+def drain_queue(q, limit, linger=0.0):
+    """
+    Block for one item, then take whatever else is already queued (up to limit).
+    With linger > 0, keep collecting for up to that many seconds after the first
+    item so that bursts spread over a few milliseconds still share one batch.
+    """
+    batch = [q.get()]
+    deadline = time.monotonic() + linger
+    while len(batch) < limit:
+        try:
+            remaining = deadline - time.monotonic()
+            batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
 
 # ---------------- ROUTES ----------------
 
@@ -91,7 +276,7 @@ except redis.ConnectionError as e:
 def handle_produce():
     global IS_LEADER
     if not IS_LEADER:
-        leader_id = REDIS_CLIENT.get("leader_lease")
+        leader_id = get_cached_leader()
         if not leader_id:
             return jsonify({"error": "No leader elected yet. Please try again."}), 503
         return jsonify({"error": "Not the leader", "leader_id": leader_id}), 400 
@@ -100,7 +285,8 @@ def handle_produce():
     if not data:
         return jsonify({"error": "No data provided"}), 400
 
-    logger.info(f"[{BROKER_ID}] Raw data received: {data}")
+    # Per-message logs are DEBUG with lazy %-args: nothing is formatted at INFO
+    logger.debug("[%s] Raw data received: %s", BROKER_ID, data)
     
     # Extract topic, key, and payload from the nested structure
     data_payload = data.get('data', {})  # Get the nested 'data' object
@@ -108,8 +294,8 @@ def handle_produce():
     key = data_payload.get('key') or data.get('key')  # Handle both nested and top-level key
     payload = data_payload.get('payload', data_payload)  # Use entire data_payload as fallback
     
-    logger.info(f"[{BROKER_ID}] Received produce request for topic '{topic}' with key '{key}'")
-    METRICS["messages_produced"] += 1
+    logger.debug("[%s] Received produce request for topic '%s' with key '%s'", BROKER_ID, topic, key)
+    bump_counter("messages_produced")
     add_activity_log("produce", f"Message received for topic '{topic}'")
 
     try:
@@ -122,7 +308,8 @@ def handle_produce():
         
         # Prepare message with metadata
         message = {
-            "msg_id": data.get("msg_id", str(uuid.uuid4())),
+            # Only mint an id when the producer sent none (a get() default is built every call)
+            "msg_id": data["msg_id"] if "msg_id" in data else str(uuid.uuid4()),
             "topic": topic,
             "partition": partition_id,
             "key": key,
@@ -130,34 +317,15 @@ def handle_produce():
             "timestamp": time.time()
         }
         
-        # Step 1: Write locally to partition log
-        with open(log_file, "a") as f:
-            f.write(json.dumps(message) + "\n")
-        
-        # Update topic metrics
-        METRICS["topics"][topic]["messages"] += 1
+        # Steps 1-3: The write pipeline appends locally, replicates to the follower and
+        # advances the HWM for the whole batch, then hands back this message's offset
+        committed = Future()
+        # Encoded exactly once: these bytes are written to the log and sent to the follower as-is
+        record = orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE)
+        LOG_QUEUE.put(((topic, partition_id), log_file, record, committed))
+        new_hwm = committed.result(timeout=COMMIT_TIMEOUT_SECONDS)
 
-        # Step 2: Replicate to follower (non-blocking)
-        if FOLLOWER_URL:
-            try:
-                logger.info(f"[{BROKER_ID}] Attempting to replicate to follower at {FOLLOWER_URL}...")
-                rep = requests.post(f"{FOLLOWER_URL}/internal/replicate", json=message, timeout=3)
-                if rep.status_code == 200:
-                    logger.info(f"[{BROKER_ID}] Follower acknowledged replication.")
-                    METRICS["replications"] += 1
-                    METRICS["last_replication"] = time.strftime("%H:%M:%S")
-                    add_activity_log("replicate", f"Data replicated to follower for topic '{topic}'")
-                else:
-                    logger.warning(f"[{BROKER_ID}] Follower replication failed with status {rep.status_code}. Continuing...")
-                    add_activity_log("warning", f"Follower replication failed (status {rep.status_code}) but message was still committed")
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"[{BROKER_ID}] Failed to reach follower: {e}. Message will still be committed.")
-                add_activity_log("warning", f"Could not reach follower: {str(e)}")
-            
-        # Step 3: Commit (update HWM for this topic-partition)
-        hwm_key = f"hwm:{topic}:{partition_id}"
-        new_hwm = REDIS_CLIENT.incr(hwm_key)
-        logger.info(f"[{BROKER_ID}] Commit success. Topic: {topic}, Partition: {partition_id}, HWM: {new_hwm}")
+        logger.debug("[%s] Commit success. Topic: %s, Partition: %d, HWM: %d", BROKER_ID, topic, partition_id, new_hwm)
 
         return jsonify({
             "status": "success", 
@@ -175,7 +343,7 @@ def handle_produce():
 @app.route("/metadata/leader", methods=["GET"])
 def get_leader():
     try:
-        leader_id = REDIS_CLIENT.get("leader_lease")
+        leader_id = get_cached_leader()
         if leader_id:
             # This is correct. The consumer will use this.
             return jsonify({"leader_id": leader_id, "is_leader": leader_id == BROKER_ID})
@@ -185,6 +353,73 @@ def get_leader():
         return jsonify({"error": "Failed to fetch leader info"}), 500
 
 
+def wants_ndjson():
+    """True if the consumer asked for a streamed NDJSON /consume response."""
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best == "application/x-ndjson"
+
+
+def render_log_records(log_file, index, first, last, topic, partition, separator):
+    """
+    Render records [first, last) as JSON message envelopes joined by `separator`.
+    Log lines are already JSON, so they are spliced into the envelope verbatim;
+    map/zip keep the per-record loop in C instead of a Python-level loop.
+    """
+    envelope = (
+        b'{"offset":%d,"topic":' + orjson.dumps(topic).replace(b"%", b"%%")
+        + b',"partition":' + str(partition).encode() + b',"data":%s}'
+    )
+    lines = get_log_view(log_file, index[last])[index[first]:index[last]].splitlines()
+    # Our HWM is 1-based, so record i has offset i + 1
+    return separator.join(map(envelope.__mod__, zip(range(first + 1, last + 1), lines)))
+
+
+def stream_log_records(log_file, index, first, last, topic, partition):
+    """Yield records [first, last) as NDJSON lines, a chunk of log at a time."""
+    for start in range(first, last, CONSUME_STREAM_RECORDS):
+        stop = min(start + CONSUME_STREAM_RECORDS, last)
+        yield render_log_records(log_file, index, start, stop, topic, partition, b"\n") + b"\n"
+
+
+def get_high_water_mark(topic, partition):
+    """Committed HWM for a partition; Redis is only read the first time a partition is seen."""
+    high_water_mark = HWM.get((topic, partition))
+    if high_water_mark is None:
+        hwm_str = REDIS_CLIENT.get(f"hwm:{topic}:{partition}")
+        # setdefault: never overwrite a newer value the committer stored meanwhile
+        high_water_mark = HWM.setdefault((topic, partition), int(hwm_str) if hwm_str else 0)
+    return high_water_mark
+
+
+def committed_range(topic, partition, offset, limit=None):
+    """
+    Resolve a fetch from `offset` to (log_file, index, first, last, high_water_mark),
+    where records [first, last) are committed and already on disk. At most `limit`
+    records are returned when a limit is given.
+    """
+    log_file = TOPICS[topic][partition]
+
+    high_water_mark = get_high_water_mark(topic, partition)
+
+    # Committed records on disk: HWM may run ahead of the log writer
+    index = get_log_index(log_file)
+    last = min(high_water_mark, len(index) - 1)
+    first = min(max(offset, 0), last)
+    if limit is not None:
+        last = min(last, first + max(limit, 1))
+    return log_file, index, first, last, high_water_mark
+
+
+def wait_for_records(topic, partition, offset, wait_ms):
+    """Block for up to wait_ms (capped) until the partition has committed records past `offset`."""
+    with HWM_ADVANCED:
+        HWM_ADVANCED.wait_for(
+            lambda: get_high_water_mark(topic, partition) > offset,
+            timeout=min(wait_ms, MAX_CONSUME_WAIT_MS) / 1000
+        )
+
+
 # --- THIS IS THE MISSING FUNCTION THAT CAUSED THE 404 ERROR ---
 @app.route("/consume", methods=["GET"])
 def handle_consume():
@@ -197,6 +432,8 @@ def handle_consume():
         topic = request.args.get('topic', 'default')
         partition = int(request.args.get('partition', 0))
         offset = int(request.args.get('offset', 0))
+        limit = int(request.args['max']) if 'max' in request.args else None
+        wait_ms = int(request.args.get('wait_ms', 0))
     except ValueError:
         return jsonify({"error": "Invalid parameters"}), 400
 
@@ -206,78 +443,130 @@ def handle_consume():
             logger.info(f"Topic '{topic}' does not exist, creating it...")
             ensure_topic_exists(topic)
         
-        if partition not in TOPICS[topic]:
+        if not 0 <= partition < len(TOPICS[topic]):
             return jsonify({"messages": [], "error": f"Partition {partition} does not exist for topic '{topic}'"}), 404
         
-        log_file = TOPICS[topic][partition]
-        
-        # Get the High Water Mark (HWM) for this topic-partition
-        hwm_key = f"hwm:{topic}:{partition}"
-        hwm_str = REDIS_CLIENT.get(hwm_key)
-        high_water_mark = int(hwm_str) if hwm_str else 0
-        
-        messages = []
-        current_offset = 0 # Log files are 0-indexed
+        log_file, index, first, last, high_water_mark = committed_range(topic, partition, offset, limit)
+        if first >= last and wait_ms > 0:
+            # Long poll: hold the request until something is committed instead of
+            # having the consumer come back on its next poll
+            wait_for_records(topic, partition, offset, wait_ms)
+            log_file, index, first, last, high_water_mark = committed_range(topic, partition, offset, limit)
+
+        if wants_ndjson():
+            count = max(last - first, 0)
+            bump_counter("messages_consumed", count)
+            if count:
+                add_activity_log("consume", f"Streaming {count} message(s) from {topic}:p{partition} at offset {offset}")
+            return Response(
+                stream_log_records(log_file, index, first, last, topic, partition),
+                mimetype="application/x-ndjson",
+                headers={"X-High-Water-Mark": str(high_water_mark)}
+            )
+
+        count = max(last - first, 0)
+        body = render_log_records(log_file, index, first, last, topic, partition, b",") if count else b""
 
-        if not os.path.exists(log_file):
-            logger.info(f"No log file found for {topic}:p{partition}, returning empty list.")
-            return jsonify({"messages": []})
-        
-        # Read the log file line by line
-        with open(log_file, "r") as f:
-            for line in f:
-                # Our HWM is 1-based, so msg_offset is current_offset + 1
-                msg_offset = current_offset + 1
-
-                if msg_offset > high_water_mark:
-                    # We have read all *committed* messages
-                    break 
-                
-                if msg_offset > offset:
-                    # This is a new message the consumer hasn't seen
-                    try:
-                        msg_data = json.loads(line.strip())
-                        messages.append({
-                            "offset": msg_offset,
-                            "topic": topic,
-                            "partition": partition,
-                            "data": msg_data
-                        })
-                    except json.JSONDecodeError:
-                        logger.warning(f"Skipping corrupt log line at offset {msg_offset}")
-
-                current_offset += 1
-        
         # Return the messages
-        METRICS["messages_consumed"] += len(messages)
-        if messages:
-            add_activity_log("consume", f"Served {len(messages)} message(s) from {topic}:p{partition} at offset {offset}")
-        return jsonify({"messages": messages, "high_water_mark": high_water_mark})
+        bump_counter("messages_consumed", count)
+        if count:
+            add_activity_log("consume", f"Served {count} message(s) from {topic}:p{partition} at offset {offset}")
+        return Response(
+            b'{"messages":[%s],"high_water_mark":%d}' % (body, high_water_mark),
+            mimetype="application/json"
+        )
 
     except Exception as e:
         logger.error(f"Error in /consume: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 
-@app.route("/health", methods=["GET"])
-def health():
+@app.route("/consume_raw", methods=["GET"])
+def handle_consume_raw():
+    """
+    Zero-copy fetch: the committed records from `offset` exactly as stored in the
+    log (one JSON message per line, no offset envelope). The first line has offset
+    X-First-Offset. Under gunicorn the byte range is handed to sendfile(2).
+    """
+    if not IS_LEADER:
+        return jsonify({"error": "Not the leader"}), 400
+
     try:
-        redis_ok = REDIS_CLIENT.ping()
-        return jsonify({
+        topic = request.args.get('topic', 'default')
+        partition = int(request.args.get('partition', 0))
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args['max']) if 'max' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid parameters"}), 400
+
+    try:
+        if topic not in TOPICS:
+            ensure_topic_exists(topic)
+        if not 0 <= partition < len(TOPICS[topic]):
+            return jsonify({"error": f"Partition {partition} does not exist for topic '{topic}'"}), 404
+
+        log_file, index, first, last, high_water_mark = committed_range(topic, partition, offset, limit)
+        start, length = index[first], index[last] - index[first]
+        headers = {
+            "X-High-Water-Mark": str(high_water_mark),
+            "X-First-Offset": str(first + 1),  # Our HWM is 1-based, so record i has offset i + 1
+        }
+
+        bump_counter("messages_consumed", last - first)
+        file_wrapper = request.environ.get("wsgi.file_wrapper")
+        if not length or file_wrapper is None:
+            # No server file wrapper (e.g. the dev server): copy the range out of the mmap
+            body = get_log_view(log_file, index[last])[start:start + length] if length else b""
+            return Response(body, mimetype="application/x-ndjson", headers=headers)
+
+        # The server sends Content-Length bytes from the file's current position
+        f = open(log_file, "rb")
+        f.seek(start)
+        headers["Content-Length"] = str(length)
+        return Response(file_wrapper(f), mimetype="application/x-ndjson", headers=headers, direct_passthrough=True)
+
+    except Exception as e:
+        logger.error(f"Error in /consume_raw: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+def build_health_snapshot():
+    """Encode the /health body: (json_bytes, http_status)."""
+    try:
+        # Ping and leader lookup share one round-trip
+        pipe = REDIS_CLIENT.pipeline(transaction=False)
+        pipe.ping()
+        pipe.get("leader_lease")
+        redis_ok, leader_id = pipe.execute()
+        return orjson.dumps({
             "status": "healthy",
             "broker_id": BROKER_ID,
             "is_leader": IS_LEADER,
             "redis_connected": redis_ok,
-            "leader": REDIS_CLIENT.get("leader_lease") or "none"
-        })
+            "leader": leader_id or "none"
+        }), 200
     except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+        return orjson.dumps({"status": "unhealthy", "error": str(e)}), 500
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return serve_snapshot("health", build_health_snapshot)
+
+
+# dashboard.html has no template variables, so it is rendered once at startup
+with app.app_context():
+    DASHBOARD_HTML = render_template("dashboard.html").encode()
+DASHBOARD_ETAG = generate_etag(DASHBOARD_HTML)
 
 
 @app.route("/leader", methods=["GET"])
 def leader_dashboard():
     """Serve the broker dashboard UI."""
-    return render_template("dashboard.html")
+    response = Response(DASHBOARD_HTML, mimetype="text/html", headers={"Cache-Control": "public, max-age=60"})
+    response.set_etag(DASHBOARD_ETAG)
+    # Answers 304 Not Modified when the browser already has this version
+    return response.make_conditional(request)
 
 
 @app.route("/topics", methods=["GET"])
@@ -298,66 +587,329 @@ def list_topics():
         return jsonify({"error": "Failed to list topics"}), 500
 
 
-@app.route("/metrics", methods=["GET"])
-def get_metrics():
-    """Return broker metrics for the dashboard."""
+def probe_follower_health():
+    """Probe the follower's /health and cache the result."""
     try:
-        # Check follower health
-        follower_health = "Unknown"
-        if FOLLOWER_URL:
-            try:
-                resp = requests.get(f"{FOLLOWER_URL}/health", timeout=2)
-                if resp.status_code == 200:
-                    follower_health = "✅ Healthy"
-                else:
-                    follower_health = "⚠️ Degraded"
-            except:
-                follower_health = "❌ Unreachable"
-        
-        return jsonify({
+        resp = SESSION.get(f"{FOLLOWER_URL}/health", timeout=2)
+        if resp.status_code == 200:
+            status = "✅ Healthy"
+        else:
+            status = "⚠️ Degraded"
+    except Exception:
+        status = "❌ Unreachable"
+    FOLLOWER_HEALTH.update(status=status, checked_at=time.time(), refreshing=False)
+
+
+def refresh_follower_health():
+    """Start a follower probe if the cached result is stale; returns its Future, or None."""
+    if not FOLLOWER_URL or FOLLOWER_HEALTH["refreshing"]:
+        return None
+    if time.time() - FOLLOWER_HEALTH["checked_at"] < FOLLOWER_HEALTH_TTL_SECONDS:
+        return None
+    FOLLOWER_HEALTH["refreshing"] = True
+    return HEALTH_EXECUTOR.submit(probe_follower_health)
+
+
+def get_follower_health():
+    """Return the cached follower health (probed by the snapshot thread)."""
+    if not FOLLOWER_URL:
+        return "Unknown"
+    return FOLLOWER_HEALTH["status"]
+
+
+def build_metrics_snapshot():
+    """Encode the /metrics body: (json_bytes, http_status)."""
+    try:
+        return orjson.dumps({
             "messages_produced": METRICS["messages_produced"],
             "messages_consumed": METRICS["messages_consumed"],
             "replications": METRICS["replications"],
             "elections_won": METRICS["elections_won"],
             "leadership_changes": METRICS["leadership_changes"],
             "follower_url": FOLLOWER_URL,
-            "follower_health": follower_health,
+            "follower_health": get_follower_health(),
             "last_replication": METRICS["last_replication"],
             "lease_time_seconds": LEASE_TIME_SECONDS,
-            "recent_activity": METRICS["recent_activity"][:20],  # Last 20 activities
+            "recent_activity": list(itertools.islice(METRICS["recent_activity"], 20)),  # Last 20 activities
             "topics": METRICS["topics"]
-        })
+        }), 200
     except Exception as e:
         logger.error(f"Error fetching metrics: {e}")
-        return jsonify({"error": "Failed to fetch metrics"}), 500
+        return orjson.dumps({"error": "Failed to fetch metrics"}), 500
+
+
+def refresh_snapshots():
+    """Rebuild the pre-encoded /health and /metrics bodies every SNAPSHOT_INTERVAL_SECONDS."""
+    while True:
+        # The follower probe runs while /health does its Redis round trip, so a
+        # refresh costs max(RTT_redis, RTT_follower) rather than their sum
+        probe = refresh_follower_health()
+        health_snapshot = build_health_snapshot()
+        if probe:
+            wait([probe], timeout=SNAPSHOT_INTERVAL_SECONDS)
+        metrics_snapshot = build_metrics_snapshot()
+        with SNAPSHOT_LOCK:
+            SNAPSHOTS["health"] = health_snapshot
+            SNAPSHOTS["metrics"] = metrics_snapshot
+        time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+
+
+def serve_snapshot(name, build):
+    """Respond with the latest snapshot, building it inline until the snapshot thread has run."""
+    with SNAPSHOT_LOCK:
+        snapshot = SNAPSHOTS.get(name)
+    body, status = snapshot or build()
+    return Response(body, status=status, mimetype="application/json")
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Return broker metrics for the dashboard."""
+    return serve_snapshot("metrics", build_metrics_snapshot)
+
+
+# ---------------- LOG WRITER ----------------
+
+# macOS has no fdatasync; fsync gives the same guarantee there
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+def write_all(fd, data):
+    """os.write until every byte of data has been written."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def write_records(fd, records, buffer):
+    """
+    Copy records into the page-aligned staging buffer and write it out with one
+    os.write per buffer-full (records larger than the buffer are written directly).
+    """
+    used = 0
+    for record in records:
+        size = len(record)
+        if used + size > len(buffer):
+            if used:
+                write_all(fd, buffer[:used])
+                used = 0
+            if size > len(buffer):
+                write_all(fd, record)
+                continue
+        buffer[used:used + size] = record
+        used += size
+    if used:
+        write_all(fd, buffer[:used])
+
+
+def append_records(log_files, log_file, records, buffer):
+    """
+    Append records to a partition log and its offset index. If any step fails, both
+    files are cut back to their size before the append and the error re-raised, so
+    the index never falls out of step with the log.
+    """
+    files = log_files.get(log_file)
+    if files is None:
+        # Load (or rebuild) the index before appending to this log
+        get_log_index(log_file)
+        files = log_files[log_file] = (
+            os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644),
+            open(f"{log_file}.idx", "ab"),
+        )
+    fd, idx_f = files
+    index = get_log_index(log_file)
+    log_size, idx_size = index[-1], (len(index) - 1) * index.itemsize
+    try:
+        # Unbuffered: the records are visible to /consume as soon as the write returns
+        write_records(fd, records, buffer)
+        if DURABILITY == "sync":
+            # Group commit: one data sync covers every record in this batch
+            fdatasync(fd)
+
+        ends = array("Q", itertools.accumulate(map(len, records), initial=log_size))[1:]
+        ends.tofile(idx_f)
+        idx_f.flush()
+    except Exception:
+        discard_log_files(log_files, log_file, log_size, idx_size)
+        raise
+    # Publish the new records to /consume only once they are on disk
+    index.extend(ends)
+
+
+def discard_log_files(log_files, log_file, log_size, idx_size):
+    """Close a log's handles and truncate the log and its index back to the given sizes."""
+    fd, idx_f = log_files.pop(log_file)
+    try:
+        idx_f.close()  # Closes the file even when flushing what is left fails
+    except OSError:
+        pass  # Whatever did get flushed is truncated below
+    os.close(fd)
+    for path, size in ((log_file, log_size), (f"{log_file}.idx", idx_size)):
+        try:
+            os.truncate(path, size)
+        except OSError as e:
+            logger.error(f"[{BROKER_ID}] Could not truncate {path} back to {size} bytes: {e}")
+
+
+def frame_replication_batch(written):
+    """
+    Encode appended groups for the follower. Each partition's records are sent
+    behind a header line "<partition> <byte length> <topic as JSON>\\n", so the
+    follower can append them without parsing a single record.
+    """
+    frames = []
+    for (topic, partition_id), entries in written:
+        records = b"".join(record for record, _ in entries)
+        frames.append(b"%d %d %s\n" % (partition_id, len(records), orjson.dumps(topic)))
+        frames.append(records)
+    return b"".join(frames)
+
+
+def replicate_batch(written):
+    """Send a batch of appended records to the follower in a single request."""
+    count = sum(len(entries) for _, entries in written)
+    body, headers = frame_replication_batch(written), REPLICATION_HEADERS
+    if len(body) > REPLICATION_COMPRESS_MIN_BYTES:
+        # LZ4 runs at GB/s, so shrinking the body costs less than sending it
+        body, headers = lz4.frame.compress(body), REPLICATION_LZ4_HEADERS
+    try:
+        logger.debug("[%s] Replicating %d message(s) to follower at %s...", BROKER_ID, count, FOLLOWER_URL)
+        rep = SESSION.post(
+            f"{FOLLOWER_URL}/internal/replicate_batch",
+            data=body,
+            headers=headers,
+            timeout=REPLICATION_TIMEOUT_SECONDS
+        )
+        if rep.status_code == 200:
+            logger.debug("[%s] Follower acknowledged replication.", BROKER_ID)
+            bump_counter("replications", count)
+            METRICS["last_replication"] = _hhmmss()
+            add_activity_log("replicate", f"Replicated {count} message(s) to follower")
+        else:
+            logger.warning(f"[{BROKER_ID}] Follower replication failed with status {rep.status_code}. Continuing...")
+            add_activity_log("warning", f"Follower replication failed (status {rep.status_code}) but {count} message(s) were still committed")
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"[{BROKER_ID}] Failed to reach follower: {e}. Messages will still be committed.")
+        add_activity_log("warning", f"Could not reach follower: {str(e)}")
+
+
+def log_writer():
+    """
+    First stage of the write pipeline: drain LOG_QUEUE in batches, append each
+    partition's records locally, then hand the batch to batch_committer().
+    """
+    log_files = {}  # {log_file_path: (log fd, index file object)}
+    # Anonymous mappings are page-aligned; reused for every batch instead of b"".join
+    buffer = memoryview(mmap.mmap(-1, LOG_WRITER_BUFFER_BYTES))
+    while True:
+        batch = drain_queue(LOG_QUEUE, LOG_WRITER_BATCH_SIZE, LOG_WRITER_LINGER_SECONDS)
+
+        entries_by_partition = {}
+        for partition_key, log_file, record, committed in batch:
+            entries_by_partition.setdefault((partition_key, log_file), []).append((record, committed))
+
+        written = []  # [((topic, partition_id), entries)] appended locally, in write order
+        for (partition_key, log_file), entries in entries_by_partition.items():
+            records = [record for record, _ in entries]
+            try:
+                append_records(log_files, log_file, records, buffer)
+                written.append((partition_key, entries))
+            except Exception as e:
+                logger.error(f"[{BROKER_ID}] Log writer failed to append {len(records)} record(s) to {log_file}: {e}")
+                for _, committed in entries:
+                    committed.set_exception(e)
+
+        if written:
+            COMMIT_QUEUE.put(written)
+
+
+def batch_committer():
+    """
+    Second stage of the write pipeline: replicate appended batches to the
+    follower in one request, advance every touched HWM with one INCRBY (all
+    pipelined), then hand each waiting produce request its offset.
+
+    Running this in its own thread keeps the follower and Redis round-trips
+    in flight while log_writer() appends the next batch; batches that pile up
+    meanwhile are merged into the next replication request.
+    """
+    while True:
+        written = [group for batch in drain_queue(COMMIT_QUEUE, COMMIT_MAX_BATCHES) for group in batch]
+
+        if FOLLOWER_URL:
+            replicate_batch(written)
+
+        # Commit: one INCRBY per partition group, one round-trip in total
+        try:
+            pipe = REDIS_CLIENT.pipeline(transaction=False)
+            for (topic, partition_id), entries in written:
+                pipe.incrby(f"hwm:{topic}:{partition_id}", len(entries))
+            new_hwms = pipe.execute()
+        except Exception as e:
+            logger.error(f"[{BROKER_ID}] HWM commit of {sum(len(entries) for _, entries in written)} message(s) failed: {e}")
+            for _, entries in written:
+                for _, committed in entries:
+                    committed.set_exception(e)
+            continue
+
+        # Offsets new_hwm - len + 1 .. new_hwm belong to the group's records, in order
+        for (partition_key, entries), new_hwm in zip(written, new_hwms):
+            HWM[partition_key] = new_hwm
+            # Per-topic counts are only updated here, by this one thread, so they need no lock
+            METRICS["topics"][partition_key[0]]["messages"] += len(entries)
+            first_offset = new_hwm - len(entries) + 1
+            for i, (_, committed) in enumerate(entries):
+                committed.set_result(first_offset + i)
+
+        # Wake consumers long-polling for these records
+        with HWM_ADVANCED:
+            HWM_ADVANCED.notify_all()
 
 
 # ---------------- LEADER ELECTION ----------------
 
+# Extend the lease only if we still own it (GET + PEXPIRE in one round trip).
+# redis-py runs this via EVALSHA and reloads the script on NOSCRIPT.
+RENEW_LEASE_SCRIPT = REDIS_CLIENT.register_script(
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+    "return redis.call('PEXPIRE', KEYS[1], ARGV[2]) else return 0 end"
+)
+
 def start_lease_renewal():
-    """Keep renewing lease if we're leader."""
-    global LEASE_RENEWAL_THREAD, IS_LEADER
+    """Schedule lease renewals (run by the leader watch thread) if none are scheduled."""
+    global NEXT_RENEWAL_AT
+    if NEXT_RENEWAL_AT is None:
+        NEXT_RENEWAL_AT = time.monotonic() + RENEW_INTERVAL_SECONDS
 
-    if LEASE_RENEWAL_THREAD and LEASE_RENEWAL_THREAD.is_alive():
+
+def renew_lease():
+    """Renew the lease once and schedule the next renewal; stops renewing on failure."""
+    global NEXT_RENEWAL_AT, IS_LEADER
+    NEXT_RENEWAL_AT = None
+    if not IS_LEADER:
+        return
+    try:
+        success = RENEW_LEASE_SCRIPT(keys=["leader_lease"], args=[BROKER_ID, LEASE_TIME_SECONDS * 1000])
+        if not success:
+            logger.warning(f"[{BROKER_ID}] Lost leadership (lease renewal failed).")
+            IS_LEADER = False
+            return
+    except Exception as e:
+        logger.error(f"[{BROKER_ID}] Lease renewal error: {e}")
+        IS_LEADER = False
         return
 
-    def _renew_lease():
-        global IS_LEADER
-        while IS_LEADER:
-            try:
-                time.sleep(RENEW_INTERVAL_SECONDS)
-                success = REDIS_CLIENT.set("leader_lease", BROKER_ID, ex=LEASE_TIME_SECONDS, xx=True)
-                if not success:
-                    logger.warning(f"[{BROKER_ID}] Lost leadership (lease renewal failed).")
-                    IS_LEADER = False
-                    break
-            except Exception as e:
-                logger.error(f"[{BROKER_ID}] Lease renewal error: {e}")
-                IS_LEADER = False
-                break
+    start_lease_renewal()
+
 
-    LEASE_RENEWAL_THREAD = threading.Thread(target=_renew_lease, daemon=True)
-    LEASE_RENEWAL_THREAD.start()
+def seed_high_water_marks():
+    """Reload the local HWM of every known partition from Redis (one MGET) before leading."""
+    partition_keys = [(topic, pid) for topic, partitions in TOPICS.items() for pid in range(len(partitions))]
+    HWM.clear()
+    if partition_keys:
+        values = REDIS_CLIENT.mget([f"hwm:{topic}:{pid}" for topic, pid in partition_keys])
+        for partition_key, value in zip(partition_keys, values):
+            HWM[partition_key] = int(value) if value else 0
 
 
 def attempt_leader_election():
@@ -367,9 +919,10 @@ def attempt_leader_election():
         logger.info(f"[{BROKER_ID}] Attempting leader election...")
         success = REDIS_CLIENT.set("leader_lease", BROKER_ID, ex=LEASE_TIME_SECONDS, nx=True)
         if success:
+            seed_high_water_marks()
             IS_LEADER = True
             logger.info(f"[{BROKER_ID}] Became the leader 🏆")
-            METRICS["elections_won"] += 1
+            bump_counter("elections_won")
             add_activity_log("election", f"{BROKER_ID} won the election and became leader 🏆")
             start_lease_renewal()
         else:
@@ -381,34 +934,91 @@ def attempt_leader_election():
         IS_LEADER = False
 
 
-def watch_leader_status():
-    """Keep checking if leadership changes."""
+def check_leader_status():
+    """Reconcile IS_LEADER with the lease currently held in Redis."""
     global IS_LEADER
+    current = REDIS_CLIENT.get("leader_lease")
+    if not current:
+        logger.info(f"[{BROKER_ID}] No leader found, retrying election...")
+        attempt_leader_election()
+    elif current == BROKER_ID and not IS_LEADER:
+        logger.info(f"[{BROKER_ID}] Regained leadership unexpectedly.")
+        seed_high_water_marks()
+        IS_LEADER = True
+        start_lease_renewal()
+    elif current != BROKER_ID and IS_LEADER:
+        logger.warning(f"[{BROKER_ID}] Leadership stolen by {current}")
+        IS_LEADER = False
+        bump_counter("leadership_changes")
+        add_activity_log("election", f"Leadership transferred to {current}")
+
+
+def enable_lease_expiry_events():
+    """
+    Turn on Redis keyspace notifications for expired keys ("Ex") so lease expiry
+    is pushed to us. Returns False when the server does not allow CONFIG SET.
+    """
+    try:
+        flags = REDIS_CLIENT.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+        missing = "".join(flag for flag in "Ex" if flag not in flags)
+        if missing:
+            REDIS_CLIENT.config_set("notify-keyspace-events", flags + missing)
+        return True
+    except redis.RedisError as e:
+        logger.warning(f"[{BROKER_ID}] Keyspace notifications unavailable ({e}); polling the leader lease instead")
+        return False
+
+
+def watch_leader_status():
+    """
+    Single thread for leadership: renews our lease when it is due and reacts to
+    leadership changes. The lease's expiry event triggers an election
+    immediately; a periodic check is kept as a safety net (and is the only
+    mechanism when keyspace notifications can't be enabled).
+    """
+    events_enabled = enable_lease_expiry_events()
+    check_interval = LEASE_TIME_SECONDS if events_enabled else LEASE_TIME_SECONDS // 2
+    pubsub = REDIS_CLIENT.pubsub(ignore_subscribe_messages=True)
+    next_check = time.monotonic() + check_interval
     while True:
         try:
-            time.sleep(LEASE_TIME_SECONDS // 2)
-            current = REDIS_CLIENT.get("leader_lease")
-            if not current:
-                logger.info(f"[{BROKER_ID}] No leader found, retrying election...")
-                attempt_leader_election()
-            elif current == BROKER_ID and not IS_LEADER:
-                logger.info(f"[{BROKER_ID}] Regained leadership unexpectedly.")
-                IS_LEADER = True
-                start_lease_renewal()
-            elif current != BROKER_ID and IS_LEADER:
-                logger.warning(f"[{BROKER_ID}] Leadership stolen by {current}")
-                IS_LEADER = False
-                METRICS["leadership_changes"] += 1
-                add_activity_log("election", f"Leadership transferred to {current}")
+            if events_enabled and not pubsub.subscribed:
+                pubsub.subscribe(f"__keyevent@{REDIS_DB}__:expired")
+            wake_at = next_check if NEXT_RENEWAL_AT is None else min(next_check, NEXT_RENEWAL_AT)
+            wait = max(0.0, wake_at - time.monotonic())
+            lease_expired = False
+            if events_enabled:
+                event = pubsub.get_message(timeout=wait)
+                lease_expired = event is not None and event["data"] == "leader_lease"
+            else:
+                time.sleep(wait)
+
+            now = time.monotonic()
+            if NEXT_RENEWAL_AT is not None and now >= NEXT_RENEWAL_AT:
+                renew_lease()
+            if lease_expired or now >= next_check:
+                check_leader_status()
+                next_check = time.monotonic() + check_interval
         except Exception as e:
             logger.error(f"[{BROKER_ID}] Exception in leader watch thread: {e}")
             time.sleep(3)
 
 
 # ---------------- MAIN ----------------
-def main():
+def start_background_threads():
+    """Start the write pipeline, leader election and snapshot threads (once per serving process)."""
+    check_redis_connection()
+    threading.Thread(target=log_writer, daemon=True).start()
+    threading.Thread(target=batch_committer, daemon=True).start()
     attempt_leader_election()
     threading.Thread(target=watch_leader_status, daemon=True).start()
+    threading.Thread(target=refresh_snapshots, daemon=True).start()
+
+
+def main():
+    # Development entry point; in production run under gunicorn (see gunicorn_conf.py),
+    # which calls start_background_threads() from its post_worker_init hook.
+    start_background_threads()
 
     logger.info(f"[{BROKER_ID}] Broker starting on port {PORT}")
     logger.info(f"[{BROKER_ID}] Current leader: {REDIS_CLIENT.get('leader_lease') or 'None'}")
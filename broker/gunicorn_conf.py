@@ -0,0 +1,25 @@
+# Gunicorn settings for the broker.
+# Run from the broker/ directory with:
+#   gunicorn -c gunicorn_conf.py broker:app
+import sys
+
+bind = "0.0.0.0:5001"
+
+# gevent workers let requests blocked on Redis / the follower overlap their round-trips.
+worker_class = "gevent"
+worker_connections = 1000
+
+# Producers and consumers reuse HTTP sessions between polls; keep their
+# connections open instead of re-handshaking after gunicorn's 2 s default.
+keepalive = 30
+
+# Topics, the offset index and leadership state live in process memory,
+# so the broker must be served by exactly one worker process.
+workers = 1
+
+
+def post_worker_init(worker):
+    # Runs inside the worker after gevent has patched the stdlib, so the
+    # background threads become cooperative greenlets.
+    broker = sys.modules[worker.wsgi.import_name]
+    broker.start_background_threads()
@@ -1,11 +1,52 @@
 #!/usr/bin/env python3
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
 import time
 import json
 import os
 import sys
 import csv
-from collections import defaultdict
+import mmap
+import queue
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pandas as pd  # C parser for the restart scan of large CSVs
+except ImportError:
+    pd = None
+
+MAX_FETCH_WORKERS = 32  # Upper bound on partitions polled concurrently
+
+SAVE_INTERVAL_SECONDS = 30  # How often offsets are made durable
+CSV_FLUSH_ROWS = 1000  # The CSV writer flushes after this many rows...
+CSV_FLUSH_IDLE_SECONDS = 1.0  # ...or once no row has arrived for this long
+LONG_POLL_MS = 500  # How long the broker may hold a /consume that has nothing new
+IDLE_SLEEP_SECONDS = 0.2  # Pause after an empty cycle, for brokers that don't honor wait_ms
+
+# Records requested per /consume call: doubled after a full batch, halved after a small one
+INITIAL_FETCH_LIMIT = 1000
+MIN_FETCH_LIMIT = 100
+MAX_FETCH_LIMIT = 100000
+
+# Slot of each metric in a pending record: [cpu, mem, net, disk, ts, server_id, remaining]
+TOPIC_IDX = {"topic-cpu": 0, "topic-mem": 1, "topic-net": 2, "topic-disk": 3}
+
+# Metric column value for each topic, taken from the producer payload
+TOPIC_EXTRACTORS = {
+    "topic-cpu": lambda p: p.get("cpu_pct", ""),
+    "topic-mem": lambda p: p.get("mem_pct", ""),
+    "topic-disk": lambda p: p.get("disk_io", ""),
+    # Combine net_in and net_out for the single 'topic-net' column
+    "topic-net": lambda p: f"{p.get('net_in', 0)}/{p.get('net_out', 0)}",
+}
+
+# Binary offset file: one little-endian u64 per (topic, partition), at slot
+# TOPIC_IDX[topic] * OFFSET_SLOTS_PER_TOPIC + partition, updated in place
+OFFSET_SLOTS_PER_TOPIC = 256
+OFFSET_SLOT = struct.Struct("<Q")
 
 class DeduplicatedConsumer:
     """
@@ -22,34 +63,65 @@ class DeduplicatedConsumer:
         self.consumer_group = consumer_group
         self.current_leader = None
         self.session = requests.Session()
+        # Polling and prefetch threads share the session; keep one open connection per thread
+        # instead of the default 10, past which urllib3 discards connections after each request
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=2 * MAX_FETCH_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.partition_counts = {}
         self.offsets = {}
 
-        # {(server_id, ts): {"topic-cpu": val, "topic-mem": val, ...}}
-        self.records = defaultdict(lambda: {t: "" for t in ["topic-cpu", "topic-mem", "topic-net", "topic-disk"]})
+        # {(server_id, ts): [cpu, mem, net, disk, ts, server_id, remaining]} - a metric is None
+        # until it arrives; remaining counts the metrics still missing
+        self.records = {}
         self.completed = set()  # To prevent duplicate writes
+        # Partitions are fetched in parallel; records/completed updates are serialized
+        self.pool = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS)
+        self.lock = threading.Lock()
+        # {(topic, partition): ((leader, offset), Future)} - next batch requested ahead of time.
+        # Prefetches get their own pool so a poller never waits on work queued behind itself.
+        self.inflight = {}
+        self.fetch_limit = {}  # {(topic, partition): records to ask for}
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS)
 
         self.columns = ["ts", "server_id", "topic-cpu", "topic-mem", "topic-net", "topic-disk"]
         self.output_file = os.path.join(os.getcwd(), f"{consumer_group}_clean_final.csv")
         self.offset_file = f"{consumer_group}_offsets.json"
+        self.offset_map_file = self.offset_file + ".bin"
+        # {broker_id: url} learned from /health, so failover can go straight to the new leader
+        self.brokers_file = f"{consumer_group}_brokers.json"
+        self.broker_urls = self._load_broker_urls()
 
         print(f"[INIT] Deduplicated consumer started for group '{consumer_group}'")
         print(f" > Output CSV: {self.output_file}")
         print(f" > Offset file: {self.offset_file}")
 
         self._load_offsets()
+        self._open_offset_map()
+        self.saved_offsets = {}  # Last offsets save_offsets() made durable
         self._load_or_init_csv()
+        # One long-lived handle for all rows, owned by the CSV writer thread. Pollers hand it
+        # complete rows through write_q so disk stalls never hold up a fetch.
+        self.csv_fh = open(self.output_file, "a", newline="", encoding="utf-8", buffering=1 << 20)
+        self.csv_writer = csv.writer(self.csv_fh)
+        self.write_q = queue.SimpleQueue()  # items: row tuple | threading.Event (flush) | None (stop)
+        self.flush_errors = 0  # Failed flush+fsync requests; save_offsets() skips a save on one
+        self.writer_thread = threading.Thread(target=self._csv_writer_loop, daemon=True)
+        self.writer_thread.start()
 
     def _load_or_init_csv(self):
         """Create CSV if not exists, or scan it to populate 'completed' set."""
-        if not os.path.exists(self.output_file):
-            # File doesn't exist, create it with header
-            with open(self.output_file, "w", newline="", encoding="utf-8") as f:
+        try:
+            # "x" creates the file only if it doesn't exist yet, in the same call
+            with open(self.output_file, "x", newline="", encoding="utf-8") as f:
                 csv.writer(f).writerow(self.columns)
             print(f"[INFO] CSV initialized with columns: {', '.join(self.columns)}")
-        else:
+        except FileExistsError:
             # File does exist. Scan it to prevent re-writing rows.
             print("[INFO] Existing CSV found. Scanning to restore 'completed' state...")
+            if pd is not None:
+                self._restore_completed_with_pandas()
+                return
             try:
                 with open(self.output_file, "r", newline="", encoding="utf-8") as f:
                     reader = csv.reader(f)
@@ -75,6 +147,22 @@ class DeduplicatedConsumer:
                 print(f"[ERROR] Could not read existing CSV: {e}")
                 sys.exit(1)
 
+    def _restore_completed_with_pandas(self):
+        """Same scan as the csv.reader path, reading only the two key columns with pandas."""
+        try:
+            with open(self.output_file, "r", newline="", encoding="utf-8") as f:
+                header = next(csv.reader(f))
+            if "ts" not in header or "server_id" not in header:
+                print("[ERROR] Could not find 'ts' or 'server_id' in CSV header. Exiting.")
+                sys.exit(1)
+            df = pd.read_csv(self.output_file, usecols=["ts", "server_id"], dtype=str,
+                             keep_default_na=False, engine="c")
+        except Exception as e:
+            print(f"[ERROR] Could not read existing CSV: {e}")
+            sys.exit(1)
+        self.completed = set(zip(df["server_id"].tolist(), df["ts"].tolist()))
+        print(f"[INFO] Restored {len(df)} completed records from CSV.")
+
     def _load_offsets(self):
         """Load offsets from the JSON file on startup."""
         if not os.path.exists(self.offset_file):
@@ -98,6 +186,43 @@ class DeduplicatedConsumer:
             print(f"[WARN] Could not load offsets: {e}. Starting from 0.")
             self.offsets = {}
 
+    def _open_offset_map(self):
+        """
+        Map the binary offset file, creating it if needed. save_offsets() copies the
+        offsets into it, so its offsets win over the JSON copy (written only on shutdown).
+        """
+        size = len(TOPIC_IDX) * OFFSET_SLOTS_PER_TOPIC * OFFSET_SLOT.size
+        fd = os.open(self.offset_map_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.offset_mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        restored = 0
+        for topic, t_idx in TOPIC_IDX.items():
+            for p in range(OFFSET_SLOTS_PER_TOPIC):
+                (offset,) = OFFSET_SLOT.unpack_from(self.offset_mm, (t_idx * OFFSET_SLOTS_PER_TOPIC + p) * OFFSET_SLOT.size)
+                if offset:
+                    self.offsets.setdefault(topic, {})[p] = offset
+                    restored += 1
+        if restored:
+            print(f"[INFO] Restored {restored} partition offsets from {self.offset_map_file}.")
+
+    def _store_offsets(self, offsets):
+        """Copy offsets into their slots of the mapped offset file."""
+        for topic, partitions in offsets.items():
+            if topic not in TOPIC_IDX:
+                print(f"[WARN] No offset slots for topic '{topic}'; not saving its offsets")
+                continue
+            for partition_id, offset in partitions.items():
+                if not 0 <= partition_id < OFFSET_SLOTS_PER_TOPIC:
+                    print(f"[WARN] No offset slot for {topic} partition {partition_id}; not saving its offset")
+                    continue
+                slot = TOPIC_IDX[topic] * OFFSET_SLOTS_PER_TOPIC + partition_id
+                OFFSET_SLOT.pack_into(self.offset_mm, slot * OFFSET_SLOT.size, offset)
+
 
     # ---------------- Leader Discovery ----------------
     def find_leader(self):
@@ -107,11 +232,11 @@ class DeduplicatedConsumer:
             try:
                 r = self.session.get(f"{broker_url}/metadata/leader", timeout=3)
                 if r.status_code == 200:
-                    leader_id = r.json().get("leader_id")
+                    leader_id = orjson.loads(r.content).get("leader_id")
                     if leader_id:
                         print(f"[INFO] Found leader ID: {leader_id}")
                         break
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
                 print(f"[DEBUG] Broker {broker_url} unreachable: {e}")
                 continue
                 
@@ -119,19 +244,53 @@ class DeduplicatedConsumer:
             print("[ERROR] Could not determine leader ID from any broker.")
             return False
             
-        for broker_url in self.brokers:
-            try:
-                r = self.session.get(f"{broker_url}/health", timeout=3)
-                if r.status_code == 200 and r.json().get("broker_id") == leader_id:
-                    self.current_leader = broker_url
-                    print(f"[INFO] Leader found at: {broker_url}")
-                    return True
-            except requests.exceptions.RequestException:
-                continue
-                
+        # Known leader URL: one /health call confirms it
+        cached_url = self.broker_urls.get(leader_id)
+        if cached_url and self._broker_id_at(cached_url) == leader_id:
+            self.current_leader = cached_url
+            print(f"[INFO] Leader found at: {cached_url}")
+            return True
+
+        # Cache miss or stale entry: probe every broker at once and remember who is where
+        broker_ids = list(self.pool.map(self._broker_id_at, self.brokers))
+        self.broker_urls = {b_id: url for url, b_id in zip(self.brokers, broker_ids) if b_id}
+        self._save_broker_urls()
+        if leader_id in self.broker_urls:
+            self.current_leader = self.broker_urls[leader_id]
+            print(f"[INFO] Leader found at: {self.current_leader}")
+            return True
+
         print(f"[ERROR] Leader {leader_id} found but not reachable at any known URL.")
         return False
 
+    def _broker_id_at(self, broker_url):
+        """broker_id reported by a broker's /health, or None if it can't be reached."""
+        try:
+            r = self.session.get(f"{broker_url}/health", timeout=3)
+            if r.status_code == 200:
+                return orjson.loads(r.content).get("broker_id")
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError):
+            pass
+        return None
+
+    def _load_broker_urls(self):
+        try:
+            with open(self.brokers_file, "rb") as f:
+                urls = orjson.loads(f.read())
+            # Only trust entries for brokers we were configured with
+            return {b_id: url for b_id, url in urls.items() if url in self.brokers}
+        except (FileNotFoundError, orjson.JSONDecodeError, AttributeError):
+            return {}
+
+    def _save_broker_urls(self):
+        try:
+            tmp = self.brokers_file + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps(self.broker_urls))
+            os.replace(tmp, self.brokers_file)
+        except OSError as e:
+            print(f"[WARN] Could not save broker map: {e}")
+
     # ---------------- Topic Discovery ----------------
     def discover_all_topics(self):
         if not self.current_leader:
@@ -145,7 +304,7 @@ class DeduplicatedConsumer:
                 self.current_leader = None
                 return False
                 
-            topics_info = r.json().get("topics", [])
+            topics_info = orjson.loads(r.content).get("topics", [])
             self.partition_counts.clear()
             found_topics = []
             for topic in topics_info:
@@ -164,97 +323,173 @@ class DeduplicatedConsumer:
             print(f"[INFO] Discovered topics: {', '.join(found_topics)}")
             return True
             
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             print(f"[ERROR] Could not contact leader: {e}")
             self.current_leader = None
             return False
 
     # ---------------- Consume ----------------
+    def _fetch_messages(self, leader, topic, partition_id, offset, limit):
+        """GET up to `limit` messages from the leader; returns (status_code, messages)."""
+        r = self.session.get(
+            f"{leader}/consume",
+            params={"topic": topic, "partition": partition_id, "offset": offset, "format": "ndjson",
+                    "max": limit, "wait_ms": LONG_POLL_MS},
+            timeout=5,
+            stream=True
+        )
+        if r.status_code != 200:
+            r.close()
+            return r.status_code, []
+
+        if r.headers.get("Content-Type", "").startswith("application/x-ndjson"):
+            # The broker streams one JSON message per line, in offset order
+            return 200, [orjson.loads(line) for line in r.iter_lines() if line]
+        # Promoted followers still answer with a single JSON document. Either way the
+        # messages come straight off the partition log, so they are already in offset order.
+        return 200, orjson.loads(r.content).get("messages", [])
+
     def consume_from_partition(self, topic, partition_id):
+        """Fetch and merge one batch; returns the number of messages received."""
         current_offset = self.offsets.get(topic, {}).get(partition_id, 0)
+        leader = self.current_leader
+        limit = self.fetch_limit.get((topic, partition_id), INITIAL_FETCH_LIMIT)
         try:
-            r = self.session.get(
-                f"{self.current_leader}/consume",
-                params={"topic": topic, "partition": partition_id, "offset": current_offset},
-                timeout=5
-            )
-            
-            if r.status_code != 200:
-                print(f"[WARN] Failed to consume {topic}:p{partition_id} (HTTP {r.status_code}). Leader may have changed.")
+            # Use the batch prefetched during the previous round if it starts where we are now
+            prefetched = self.inflight.pop((topic, partition_id), None)
+            status, messages = 200, []
+            if prefetched and prefetched[0] == (leader, current_offset):
+                status, messages = prefetched[1].result()
+            if status == 200 and not messages:
+                status, messages = self._fetch_messages(leader, topic, partition_id, current_offset, limit)
+
+            if status != 200:
+                print(f"[WARN] Failed to consume {topic}:p{partition_id} (HTTP {status}). Leader may have changed.")
                 self.current_leader = None
                 return
-                
-            messages = sorted(r.json().get("messages", []), key=lambda m: m.get("offset", -1))
             if not messages:
                 return # No new messages
-                
-            new_offset = current_offset
-            for msg in messages:
-                # The 'data' field contains the full message written by the leader
-                # The 'payload' field within 'data' is the original producer payload
-                payload = msg.get("data", {}).get("payload", {})
-                ts, sid = payload.get("ts"), payload.get("server_id")
-                if not ts or not sid:
-                    continue
 
-                # Logic to extract correct metric based on topic
-                metric_val = ""
-                if topic == "topic-cpu":
-                    metric_val = payload.get("cpu_pct", "")
-                elif topic == "topic-mem":
-                    metric_val = payload.get("mem_pct", "")
-                elif topic == "topic-disk":
-                    metric_val = payload.get("disk_io", "")
-                elif topic == "topic-net":
-                    # Combine net_in and net_out for the single 'topic-net' column
-                    net_in = payload.get("net_in", 0)
-                    net_out = payload.get("net_out", 0)
-                    metric_val = f"{net_in}/{net_out}" 
-
-                if metric_val == "":
-                    print(f"[WARN] Skipping msg in {topic}, missing expected metric keys in {payload}")
-                    continue 
-
-                key = (str(sid), str(ts)) # Ensure keys are strings for consistency
-
-                # Update in-memory record
-                self.records[key][topic] = metric_val
-                self.records[key]["ts"] = str(ts)
-                self.records[key]["server_id"] = str(sid)
-
-                # Check completion
-                if all(self.records[key][t] != "" for t in ["topic-cpu", "topic-mem", "topic-net", "topic-disk"]):
-                    if key not in self.completed:
-                        self._write_row(self.records[key])
-                        self.completed.add(key)
-                        # Clean up memory for completed record
-                        del self.records[key]
-
-                # We will ask for the next offset *after* this one
-                new_offset = msg.get("offset") + 1
-            
-            # Update offset after processing batch
+            # Grow the batch while the partition has a backlog, shrink it once caught up
+            if len(messages) >= limit:
+                limit = min(limit * 2, MAX_FETCH_LIMIT)
+            elif len(messages) < MIN_FETCH_LIMIT:
+                limit = max(limit // 2, MIN_FETCH_LIMIT)
+            self.fetch_limit[(topic, partition_id)] = limit
+
+            # Start fetching the following batch while this one is merged and written
+            next_offset = messages[-1].get("offset", -1) + 1
+            self.inflight[(topic, partition_id)] = (
+                (leader, next_offset),
+                self.prefetch_pool.submit(self._fetch_messages, leader, topic, partition_id, next_offset, limit),
+            )
+
+            with self.lock:
+                new_offset = self._process_messages(topic, messages, current_offset)
+
+            # Update offset after processing batch (in memory; save_offsets persists it)
             self.offsets[topic][partition_id] = new_offset
+            return len(messages)
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             print(f"[ERROR] Network error consuming {topic}:p{partition_id}: {e}")
             self.current_leader = None
 
+    def _process_messages(self, topic, messages, current_offset):
+        """Merge a fetched batch into the pending records; returns the next offset to fetch."""
+        new_offset = current_offset
+        idx = TOPIC_IDX[topic]
+        extract = TOPIC_EXTRACTORS[topic]
+        for msg in messages:
+            # The 'data' field contains the full message written by the leader
+            # The 'payload' field within 'data' is the original producer payload
+            payload = msg.get("data", {}).get("payload", {})
+            ts, sid = payload.get("ts"), payload.get("server_id")
+            if not ts or not sid:
+                continue
+
+            metric_val = extract(payload)
+
+            if metric_val == "":
+                print(f"[WARN] Skipping msg in {topic}, missing expected metric keys in {payload}")
+                continue 
+
+            # Ensure keys are strings for consistency. Server ids ("server_N") repeat for
+            # every message, so interning reuses one string with a cached hash for each.
+            key = (sys.intern(str(sid)), str(ts))
+
+            # Update in-memory record
+            rec = self.records.get(key)
+            if rec is None:
+                # ts/server_id are filled once, when the first metric for the key arrives
+                rec = self.records[key] = [None, None, None, None, key[1], key[0], 4]
+            if rec[idx] is None:
+                rec[6] -= 1
+            rec[idx] = metric_val
+
+            # Check completion
+            if rec[6] == 0:
+                if key not in self.completed:
+                    self._write_row(rec)
+                    self.completed.add(key)
+                    # Clean up memory for completed record
+                    del self.records[key]
+
+            # We will ask for the next offset *after* this one
+            new_offset = msg.get("offset") + 1
+        return new_offset
+
     # ---------------- Write Row ----------------
-    def _write_row(self, data):
-        """Write one deduplicated row."""
-        try:
-            with open(self.output_file, "a", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=self.columns)
-                writer.writerow({col: data.get(col, "") for col in self.columns})
-            print(f"[WRITE] {data['server_id']} @ {data['ts']} - complete row written")
-        except Exception as e:
-            print(f"[ERROR] Failed to write row to CSV: {e}")
+    def _write_row(self, rec):
+        """Queue one deduplicated row for the CSV writer thread."""
+        # Rows are only written once complete, so every column is present
+        self.write_q.put((rec[4], rec[5], rec[0], rec[1], rec[2], rec[3]))
+
+    def _csv_writer_loop(self):
+        """
+        Append queued rows to the CSV; flush every CSV_FLUSH_ROWS rows or when idle.
+        A flush request (Event) is set only after every row queued ahead of it has been
+        flushed and fsynced; save_offsets() waits on it before it persists any offset.
+        """
+        pending = 0
+        while True:
+            try:
+                item = self.write_q.get(timeout=CSV_FLUSH_IDLE_SECONDS)
+            except queue.Empty:
+                if pending:
+                    self.csv_fh.flush()
+                    pending = 0
+                continue
+
+            if isinstance(item, tuple):
+                try:
+                    self.csv_writer.writerow(item)
+                    print(f"[WRITE] {item[1]} @ {item[0]} - complete row written")
+                except Exception as e:
+                    print(f"[ERROR] Failed to write row to CSV: {e}")
+                pending += 1
+                if pending >= CSV_FLUSH_ROWS:
+                    self.csv_fh.flush()
+                    pending = 0
+                continue
+
+            # Flush request (Event) or stop sentinel (None): everything queued before it is written
+            try:
+                self.csv_fh.flush()
+                os.fsync(self.csv_fh.fileno())
+            except OSError as e:
+                self.flush_errors += 1
+                print(f"[ERROR] Failed to flush CSV: {e}")
+            pending = 0
+            if item is None:
+                self.csv_fh.close()
+                return
+            item.set()
 
     # ---------------- Main Loop ----------------
     def run(self):
         print("\n[INFO] Starting deduplicated consumer loop (Ctrl+C to stop)...")
-        last_save = time.time()
+        self._schedule_save()
         try:
             while True:
                 if not self.current_leader:
@@ -272,32 +507,66 @@ class DeduplicatedConsumer:
                         time.sleep(3)
                         continue
 
-                # --- Poll all partitions ---
-                for topic, count in self.partition_counts.items():
-                    for p in range(count):
-                        self.consume_from_partition(topic, p)
+                # --- Poll all partitions concurrently (one cycle costs ~one RTT) ---
+                partitions = [(topic, p) for topic, count in self.partition_counts.items() for p in range(count)]
+                received = list(self.pool.map(lambda tp: self.consume_from_partition(*tp), partitions))
                 
-                # --- Periodically save offsets ---
-                if time.time() - last_save > 30: # Save every 30 seconds
-                    self.save_offsets()
-                    last_save = time.time()
-
-                time.sleep(2) # Poll interval
+                # The broker long-polls for us; only back off when a whole cycle came back empty
+                if not any(received):
+                    time.sleep(IDLE_SLEEP_SECONDS)
 
         except KeyboardInterrupt:
             print("\n[INFO] Gracefully stopping consumer...")
+            self._save_timer.cancel()
             self.save_offsets()
+            self.write_offsets_json()
+            self.write_q.put(None)
+            self.writer_thread.join()
             print("[INFO] Exiting.")
             sys.exit(0)
 
+    def _schedule_save(self):
+        """Save offsets every SAVE_INTERVAL_SECONDS from a timer thread, off the poll loop."""
+        self._save_timer = threading.Timer(SAVE_INTERVAL_SECONDS, self._periodic_save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _periodic_save(self):
+        self.save_offsets()
+        self._schedule_save()
+
     def save_offsets(self):
+        """Persist the offsets whose rows the CSV writer has flushed and fsynced."""
         try:
-            with open(self.offset_file, "w") as f:
-                json.dump(self.offsets, f, indent=2)
+            # A batch's rows are queued before its offset is advanced, so every row
+            # behind this snapshot is already in write_q ahead of the flush request
+            offsets = {topic: dict(partitions) for topic, partitions in list(self.offsets.items())}
+            errors = self.flush_errors
+            flushed = threading.Event()
+            self.write_q.put(flushed)
+            flushed.wait()
+            if self.flush_errors != errors:
+                print("[ERROR] CSV rows not on disk; keeping the previously saved offsets.")
+                return
+            # Only now may the offsets skip past those rows
+            self._store_offsets(offsets)
+            self.offset_mm.flush()
+            self.saved_offsets = offsets
             print(f"[INFO] Offsets saved.")
         except Exception as e:
             print(f"[ERROR] Failed to save offsets: {e}")
 
+    def write_offsets_json(self):
+        """Write the human-readable JSON copy of the last saved offsets (on shutdown)."""
+        try:
+            # Write a temp file and swap it in, so a crash never leaves a half-written offset file
+            tmp = self.offset_file + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.saved_offsets, f, separators=(",", ":"))
+            os.replace(tmp, self.offset_file)
+        except Exception as e:
+            print(f"[ERROR] Failed to write {self.offset_file}: {e}")
+
 
 # ---------------- Run ----------------
 if __name__ == "__main__":
@@ -1,12 +1,24 @@
+import sys
 import os
-import json
 import time
 import threading
-from flask import Flask, render_template, request, jsonify
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template, request, jsonify
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from werkzeug.http import generate_etag
 import logging
 
+
+# Run from the service directory; shared modules live in common/ at the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.orjson_provider import ORJSONProvider
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,46 +30,79 @@ BROKER_NODES = [
     'http://192.168.191.242:5002'
 ]
 
+LONG_POLL_MS = 5000  # How long the broker may hold a /consume that has nothing new
+FETCH_MAX_MESSAGES = 500  # Messages per /consume; a backlog drains in batches of this size
+MIN_EMPTY_POLL_SECONDS = 1.0  # Empty replies faster than this mean the broker ignored wait_ms
+LEADER_REFRESH_SECONDS = 5  # Background leader re-check; half the brokers' 10 s lease
+
 # Global state
 current_leader = None
 session = requests.Session()
+# Every subscription thread holds a long poll on this session; size the pool so each
+# keeps its connection open instead of the default 10, past which sockets are dropped.
+# No transport retries: a failed poll already triggers a leader re-check and a retry.
+_adapter = HTTPAdapter(pool_connections=len(BROKER_NODES), pool_maxsize=128, max_retries=0)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
 subscriptions = {}  # {subscription_id: {topic, partition, offset, messages}}
 subscription_counter = 0
 running_subscriptions = {}  # {subscription_id: thread}
+leader_refresh = threading.Event()  # Set to make the leader watcher re-check right away
+probe_pool = ThreadPoolExecutor(max_workers=len(BROKER_NODES))
+
+def _leader_id_from(broker_url):
+    """Leader id reported by one broker, or None."""
+    try:
+        response = session.get(f"{broker_url}/metadata/leader", timeout=3)
+        if response.status_code == 200:
+            leader_id = orjson.loads(response.content).get("leader_id")
+            logger.info(f"Broker {broker_url} reports leader is: {leader_id}")
+            return leader_id
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        logger.warning(f"Could not contact broker {broker_url}: {e}")
+    return None
+
+def _broker_id_of(broker_url):
+    """Broker id a broker reports from /health, or None."""
+    try:
+        response = session.get(f"{broker_url}/health", timeout=3)
+        if response.status_code == 200:
+            return orjson.loads(response.content).get("broker_id")
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        logger.warning(f"Could not contact broker {broker_url}: {e}")
+    return None
 
 def discover_leader():
-    """Find the current leader broker."""
+    """Find the current leader broker, probing all brokers in parallel."""
     global current_leader
     
     # Step 1: Get leader ID
-    leader_id = None
-    for broker_url in BROKER_NODES:
-        try:
-            response = session.get(f"{broker_url}/metadata/leader", timeout=3)
-            if response.status_code == 200:
-                leader_id = response.json().get("leader_id")
-                logger.info(f"Broker {broker_url} reports leader is: {leader_id}")
-                break
-        except requests.RequestException as e:
-            logger.warning(f"Could not contact broker {broker_url}: {e}")
-    
-    if not leader_id:
-        return None
+    leader_id = next((l_id for l_id in probe_pool.map(_leader_id_from, BROKER_NODES) if l_id), None)
     
     # Step 2: Find URL for that leader ID
-    for broker_url in BROKER_NODES:
+    leader_url = None
+    if leader_id:
+        for broker_url, broker_id in zip(BROKER_NODES, probe_pool.map(_broker_id_of, BROKER_NODES)):
+            if broker_id == leader_id:
+                leader_url = broker_url
+                break
+
+    if leader_url != current_leader:
+        logger.info(f"Leader found at: {leader_url}" if leader_url else "No reachable leader")
+    current_leader = leader_url
+    return leader_url
+
+def _leader_watcher():
+    """Keep current_leader fresh so request handlers and pollers never probe inline."""
+    while True:
         try:
-            response = session.get(f"{broker_url}/health", timeout=3)
-            if response.status_code == 200:
-                broker_id = response.json().get("broker_id")
-                if broker_id == leader_id:
-                    current_leader = broker_url
-                    logger.info(f"Leader found at: {broker_url}")
-                    return broker_url
-        except requests.RequestException as e:
-            logger.warning(f"Could not contact broker {broker_url}: {e}")
-    
-    return None
+            discover_leader()
+        except Exception as e:
+            logger.error(f"Leader discovery failed: {e}")
+        leader_refresh.wait(LEADER_REFRESH_SECONDS)
+        leader_refresh.clear()
+
+threading.Thread(target=_leader_watcher, daemon=True).start()
 
 def poll_messages(subscription_id):
     """Background thread to poll messages for a subscription."""
@@ -65,64 +110,79 @@ def poll_messages(subscription_id):
     
     while subscription_id in running_subscriptions:
         try:
-            if not current_leader:
-                discover_leader()
-            
-            if not current_leader:
-                time.sleep(3)
+            leader = current_leader
+            if not leader:
+                leader_refresh.set()
+                time.sleep(1)
                 continue
             
+            # Long poll: the broker answers as soon as a message past our offset commits
+            started = time.monotonic()
             response = session.get(
-                f"{current_leader}/consume",
+                f"{leader}/consume",
                 params={
                     'topic': sub['topic'],
                     'partition': sub['partition'],
-                    'offset': sub['offset']
+                    'offset': sub['offset'],
+                    'max': FETCH_MAX_MESSAGES,
+                    'wait_ms': LONG_POLL_MS
                 },
-                timeout=5
+                timeout=LONG_POLL_MS / 1000 + 5
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 messages = data.get('messages', [])
                 
                 if messages:
-                    for msg in messages:
-                        sub['messages'].append(msg)
-                        sub['offset'] = msg['offset']
-                    
-                    # Keep only last 100 messages
-                    if len(sub['messages']) > 100:
-                        sub['messages'] = sub['messages'][-100:]
+                    # The deque keeps only the last 100 messages
+                    sub['messages'].extend(messages)
+                    sub['offset'] = messages[-1]['offset']
                     
                     logger.info(f"Subscription {subscription_id}: Received {len(messages)} messages")
+                else:
+                    # Don't spin against a broker that returns empty replies immediately
+                    elapsed = time.monotonic() - started
+                    if elapsed < MIN_EMPTY_POLL_SECONDS:
+                        time.sleep(MIN_EMPTY_POLL_SECONDS - elapsed)
             
             elif response.status_code == 404:
                 logger.warning(f"Topic {sub['topic']} or partition {sub['partition']} not found")
+                time.sleep(3)
             
             elif response.status_code == 400:
                 # Leader changed
-                discover_leader()
-            
-            time.sleep(2)  # Poll every 2 seconds
+                leader_refresh.set()
+                time.sleep(1)
+
+            else:
+                time.sleep(3)
             
         except requests.RequestException as e:
             logger.error(f"Error polling messages: {e}")
-            discover_leader()
+            leader_refresh.set()
             time.sleep(3)
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
             time.sleep(3)
 
+# consumer.html has no template variables, so it is rendered once at startup
+with app.app_context():
+    CONSUMER_HTML = render_template('consumer.html').encode()
+CONSUMER_ETAG = generate_etag(CONSUMER_HTML)
+
 @app.route('/')
 def index():
     """Serve the consumer UI."""
-    return render_template('consumer.html')
+    response = Response(CONSUMER_HTML, mimetype='text/html', headers={'Cache-Control': 'public, max-age=60'})
+    response.set_etag(CONSUMER_ETAG)
+    # Answers 304 Not Modified when the browser already has this version
+    return response.make_conditional(request)
 
 @app.route('/api/leader', methods=['GET'])
 def get_leader():
     """Get current leader information."""
-    leader = discover_leader()
+    leader = current_leader
     if leader:
         return jsonify({"leader_url": leader, "status": "connected"})
     return jsonify({"error": "No leader found", "status": "disconnected"}), 503
@@ -130,19 +190,20 @@ def get_leader():
 @app.route('/api/topics', methods=['GET'])
 def get_topics():
     """Get list of available topics from the broker."""
-    if not current_leader:
-        discover_leader()
-    
-    if not current_leader:
+    leader = current_leader
+    if not leader:
+        leader_refresh.set()
         return jsonify({"error": "No leader available"}), 503
     
     try:
-        response = session.get(f"{current_leader}/topics", timeout=3)
+        response = session.get(f"{leader}/topics", timeout=3)
         if response.status_code == 200:
-            return jsonify(response.json())
+            # The broker's topic list is passed through without re-encoding
+            return Response(response.content, mimetype="application/json")
         return jsonify({"topics": []})
     except requests.RequestException as e:
         logger.error(f"Failed to get topics: {e}")
+        leader_refresh.set()
         return jsonify({"topics": []})
 
 @app.route('/api/subscribe', methods=['POST'])
@@ -164,7 +225,7 @@ def subscribe():
         'topic': topic,
         'partition': partition,
         'offset': 0,
-        'messages': [],
+        'messages': deque(maxlen=100),
         'created_at': time.time()
     }
     
@@ -209,7 +270,8 @@ def get_messages(subscription_id):
         "topic": sub['topic'],
         "partition": sub['partition'],
         "offset": sub['offset'],
-        "messages": sub['messages'][-50:]  # Return last 50 messages
+        # Return last 50 messages
+        "messages": list(itertools.islice(sub['messages'], max(0, len(sub['messages']) - 50), None))
     })
 
 @app.route('/api/unsubscribe/<subscription_id>', methods=['DELETE'])
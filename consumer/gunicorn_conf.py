@@ -0,0 +1,13 @@
+# Gunicorn settings for the consumer web UI.
+# Run from the consumer/ directory with:
+#   gunicorn -c gunicorn_conf.py consumer_server:app
+bind = "0.0.0.0:5004"
+
+# gevent workers: each subscription's poller spends its time blocked in a
+# /consume long poll, which costs a greenlet instead of an OS thread.
+worker_class = "gevent"
+worker_connections = 1000
+
+# Subscriptions and their buffered messages live in process memory, so the
+# UI must be served by exactly one worker process.
+workers = 1
@@ -1,16 +1,32 @@
 import redis
 import time
 import threading
+import atexit
 import logging
 import socket
 import requests
-import json # <-- ADDED
+import sys
 import os # <-- ADDED
+import zlib
+import collections
+import itertools
+from concurrent.futures import Future, wait
+from array import array
+import mmap
+import orjson
+import lz4.frame
+
+from flask import Flask, Response, request, jsonify, render_template
+
+# Run from the service directory; shared modules live in common/ at the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.orjson_provider import ORJSONProvider
+from werkzeug.http import generate_etag
 
-from flask import Flask, request, jsonify, render_template
 
 # Initialize Flask app first
 app = Flask(__name__, template_folder='../broker/templates')
+app.json = ORJSONProvider(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,18 +36,60 @@ logger = logging.getLogger(__name__)
 BROKER_ID = f"follower-{socket.gethostname()}"
 REDIS_HOST = '192.168.191.242'
 REDIS_PORT = 6379
+REDIS_MAX_CONNECTIONS = 64  # Redis pool size; requests wait up to 2 s for a free connection
 PORT = 5002
 FOLLOWER_URL = None # This is correct, as it has no follower
 LOG_FILE = f"{BROKER_ID}_log.txt" # <-- ADDED for consistency
 
 LEASE_TIME_SECONDS = 10
 RENEW_INTERVAL_SECONDS = 5
+MAX_CONSUME_WAIT_MS = 5000  # Upper bound on a /consume long poll (wait_ms)
+MAX_LONG_POLLS = 16  # /consume requests allowed to wait at once; keep below gunicorn_conf.threads
+LOG_SYNC_TIMEOUT_SECONDS = 10  # How long a request waits for the fsync covering its write
+SNAPSHOT_INTERVAL_SECONDS = 0.5  # How often the /metrics body is rebuilt
 # --- End Configuration ---
 
 
 # Global state
 IS_LEADER = False
 LEASE_RENEWAL_THREAD = None
+HWM_ADVANCED = threading.Condition()  # Notified whenever a promoted-leader produce commits
+LONG_POLL_SLOTS = threading.BoundedSemaphore(MAX_LONG_POLLS)  # Each waiting /consume holds one
+
+# Local copy of the "high_water_mark" key. Only the leader advances it and only the
+# leader serves /consume, so it is read from Redis once per promotion and then kept
+# current by handle_produce. None means "not read since becoming leader".
+LOCAL_HWM = None
+LOCAL_HWM_LOCK = threading.Lock()
+
+# Offset index for LOG_FILE, in the broker's format: LOG_OFFSETS[i] is the byte position
+# where the message with offset i + 1 starts, and the last entry is the end of the log.
+# Built once at startup, then appended by produce. /consume reads the raw lines through
+# a read-only mmap, so no message is held in memory.
+LOG_OFFSETS = array("Q", [0])
+CORRUPT_OFFSETS = set()  # Offsets of lines that failed to parse when the log was scanned
+INDEX_LOCK = threading.Lock()
+LOG_VIEW = None  # Read-only mmap of LOG_FILE, remapped once the log outgrows it
+LOG_VIEW_LOCK = threading.Lock()
+
+# "<LOG_FILE>.idx" holds the byte position where each LOG_FILE record ends, in the
+# broker's offset index format, so a restart can split the log without parsing it.
+# It is only kept up to date while every record in LOG_FILE is valid JSON.
+LOG_INDEX_FILE = f"{LOG_FILE}.idx"
+LOG_INDEX_LIVE = False
+
+# Open append handles for every log this node writes, so a write is one write() instead
+# of open() + write() + close(). Writes go straight to the OS; the syncer thread then
+# fsyncs each written log once per pass and releases the requests waiting on it.
+LOG_WRITERS = {}  # {log_file_path: unbuffered append handle}
+LOG_SIZES = {}  # {log_file_path: bytes written}, to cut a failed write back out
+DIRTY_LOGS = {}  # {log_file_path: [Future, ...]} written since the last sync, and their waiters
+LOG_WRITERS_LOCK = threading.Lock()
+LOG_SYNC_PENDING = threading.Condition(LOG_WRITERS_LOCK)  # Notified when DIRTY_LOGS gains a log
+
+# One lock per (topic, partition): writes to the same partition log stay in order,
+# different partitions are replicated in parallel.
+PARTITION_LOCKS = collections.defaultdict(threading.Lock)
 
 # Topic and Partition Management
 TOPICS = {}  # {topic_name: {partition_id: log_file_path}}
@@ -45,26 +103,41 @@ METRICS = {
     "elections_won": 0,
     "leadership_changes": 0,
     "last_replication": None,
-    "recent_activity": [],
+    "recent_activity": collections.deque(maxlen=50),  # Most recent activity first
     "topics": {}
 }
 
+METRICS_LOCK = threading.Lock()  # Guards METRICS["recent_activity"]
+
+# Pre-encoded /metrics body, rebuilt by the snapshot thread: (body_bytes, status)
+METRICS_SNAPSHOT = None
+
+# [second, "HH:MM:SS"] - dashboard timestamps only change once a second
+_TS_CACHE = [0, ""]
+
+def _hhmmss():
+    now = int(time.time())
+    if now != _TS_CACHE[0]:
+        _TS_CACHE[1] = time.strftime("%H:%M:%S", time.localtime(now))
+        _TS_CACHE[0] = now
+    return _TS_CACHE[1]
+
 def add_activity_log(log_type, message):
-    """Add an activity log entry."""
-    timestamp = time.strftime("%H:%M:%S")
-    METRICS["recent_activity"].insert(0, {
-        "type": log_type,
-        "message": message,
-        "timestamp": timestamp
-    })
-    if len(METRICS["recent_activity"]) > 50:
-        METRICS["recent_activity"].pop()
+    """Add an activity log entry (the deque drops the oldest past 50)."""
+    timestamp = _hhmmss()
+    with METRICS_LOCK:
+        METRICS["recent_activity"].appendleft({
+            "type": log_type,
+            "message": message,
+            "timestamp": timestamp
+        })
 
 def get_partition_for_key(key, num_partitions):
-    """Hash-based partition assignment."""
+    """Hash-based partition assignment, identical on every broker and restart."""
     if key is None:
         return 0
-    return hash(key) % num_partitions
+    # CRC32 is stable across restarts (hash() of str is salted per process)
+    return zlib.crc32(key if isinstance(key, bytes) else str(key).encode()) % num_partitions
 
 def ensure_topic_exists(topic_name, num_partitions=DEFAULT_PARTITIONS):
     """Create topic with partitions if it doesn't exist."""
@@ -80,13 +153,148 @@ def ensure_topic_exists(topic_name, num_partitions=DEFAULT_PARTITIONS):
 
 # Initialize Redis client
 try:
-    REDIS_CLIENT = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+    # One pool shared by request handlers and background threads; keep-alive and
+    # periodic health checks keep idle connections usable instead of reconnecting
+    REDIS_POOL = redis.BlockingConnectionPool(
+        host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS, timeout=2,
+        socket_keepalive=True, health_check_interval=30
+    )
+    REDIS_CLIENT = redis.Redis(connection_pool=REDIS_POOL)
     REDIS_CLIENT.ping()
     logger.info(f"[{BROKER_ID}] Successfully connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
 except redis.ConnectionError as e:
     logger.error(f"[{BROKER_ID}] Failed to connect to Redis: {e}")
     raise
 
+# macOS has no fdatasync; fsync gives the same guarantee there
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+def append_to_log(log_file, data):
+    """
+    Write bytes to a log and return a Future that is resolved once an fsync covers them.
+    Callers serialize writes to the same log. A failed write is cut back out of the log
+    and re-raised, so later writes never land behind a partial record.
+    """
+    writer = LOG_WRITERS.get(log_file)
+    if writer is None:
+        with LOG_WRITERS_LOCK:
+            writer = LOG_WRITERS.get(log_file)
+            if writer is None:
+                writer = open(log_file, "ab", buffering=0)
+                LOG_SIZES[log_file] = os.fstat(writer.fileno()).st_size
+                LOG_WRITERS[log_file] = writer
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[writer.write(view):]
+    except Exception:
+        os.ftruncate(writer.fileno(), LOG_SIZES[log_file])
+        raise
+    LOG_SIZES[log_file] += len(data)
+
+    synced = Future()
+    with LOG_SYNC_PENDING:
+        DIRTY_LOGS.setdefault(log_file, []).append(synced)
+        LOG_SYNC_PENDING.notify()
+    return synced
+
+def sync_logs():
+    """Fsync every log written since the last call, then resolve the writes waiting on it."""
+    with LOG_SYNC_PENDING:
+        dirty = list(DIRTY_LOGS.items())
+        DIRTY_LOGS.clear()
+    for log_file, waiters in dirty:
+        try:
+            fdatasync(LOG_WRITERS[log_file].fileno())
+        except Exception as e:
+            logger.error(f"[{BROKER_ID}] Failed to sync {log_file}: {e}")
+            for synced in waiters:
+                synced.set_exception(e)
+            continue
+        for synced in waiters:
+            synced.set_result(None)
+
+atexit.register(sync_logs)
+
+def start_log_syncer():
+    """
+    Start the background thread that group-commits log writes: one fsync per log covers
+    every write made while the previous pass ran, and no request is acked before it.
+    """
+    def _sync_loop():
+        while True:
+            with LOG_SYNC_PENDING:
+                LOG_SYNC_PENDING.wait_for(lambda: DIRTY_LOGS)
+            sync_logs()
+
+    threading.Thread(target=_sync_loop, daemon=True).start()
+
+def wait_for_sync(*synced):
+    """Block until the given writes are fsynced; raises if any of them failed."""
+    done, not_done = wait(synced, timeout=LOG_SYNC_TIMEOUT_SECONDS)
+    if not_done:
+        raise TimeoutError(f"log sync took longer than {LOG_SYNC_TIMEOUT_SECONDS}s")
+    for f in done:
+        f.result()
+
+def consume_entry(offset, record):
+    """Encode a stored JSON record as its /consume entry; the record is spliced in as-is."""
+    return b'{"offset":%d,"data":%s}' % (offset, record)
+
+def load_message_index():
+    """Build LOG_OFFSETS for LOG_FILE, using its .idx to skip the parse when it is current."""
+    global LOG_INDEX_LIVE
+    if not os.path.exists(LOG_FILE):
+        LOG_INDEX_LIVE = True
+        open(LOG_INDEX_FILE, "wb").close()
+        return
+    log_size = os.path.getsize(LOG_FILE)
+
+    if os.path.exists(LOG_INDEX_FILE):
+        with open(LOG_INDEX_FILE, "rb") as f:
+            raw = f.read()
+        LOG_OFFSETS.frombytes(raw[:len(raw) - len(raw) % LOG_OFFSETS.itemsize])
+        if LOG_OFFSETS[-1] == log_size:
+            LOG_INDEX_LIVE = True
+            logger.info(f"[{BROKER_ID}] Loaded {len(LOG_OFFSETS) - 1} message(s) from {LOG_FILE} via its index")
+            return
+        del LOG_OFFSETS[1:]
+
+    # Index missing or stale: one scan that validates every line
+    with open(LOG_FILE, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            LOG_OFFSETS.append(LOG_OFFSETS[-1] + len(line))
+            try:
+                orjson.loads(line)
+            except orjson.JSONDecodeError:
+                CORRUPT_OFFSETS.add(len(LOG_OFFSETS) - 1)
+    if LOG_OFFSETS[-1] < log_size:
+        # A write cut short by a crash; it was never acked, and produce would append onto it
+        logger.warning(f"[{BROKER_ID}] Dropping a partial record at the end of {LOG_FILE}")
+        os.truncate(LOG_FILE, LOG_OFFSETS[-1])
+    LOG_INDEX_LIVE = not CORRUPT_OFFSETS
+    if LOG_INDEX_LIVE:
+        with open(LOG_INDEX_FILE, "wb") as f:
+            LOG_OFFSETS[1:].tofile(f)
+    logger.info(f"[{BROKER_ID}] Indexed {len(LOG_OFFSETS) - 1} message(s) from {LOG_FILE}")
+
+def get_log_view(min_size):
+    """Return a read-only mmap of LOG_FILE covering at least min_size bytes."""
+    global LOG_VIEW
+    view = LOG_VIEW
+    if view is None or len(view) < min_size:
+        with LOG_VIEW_LOCK:
+            view = LOG_VIEW
+            if view is None or len(view) < min_size:
+                with open(LOG_FILE, "rb") as f:
+                    view = LOG_VIEW = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return view
+
+load_message_index()
+
 # --- Follower's Replication Endpoint ---
 
 @app.route("/internal/replicate", methods=["POST"])
@@ -103,11 +311,10 @@ def handle_replicate():
     if not data:
         return jsonify({"error": "No data provided"}), 400
     
-    logger.info(f"[{BROKER_ID}] Replication data received: {data}")
-    
     # Extract topic and partition from message
     topic = data.get("topic") or "default"  # Handle empty strings
     partition = data.get("partition", 0)
+    logger.info(f"[{BROKER_ID}] Replication received for {topic}:p{partition} ({request.content_length} bytes)")
         
     try:
         # Ensure topic exists
@@ -120,13 +327,16 @@ def handle_replicate():
         log_file = topic_partitions[partition]
         
         # Write to partition log
-        with open(log_file, "a") as f:
-            f.write(json.dumps(data) + "\n")
+        record = orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+        with PARTITION_LOCKS[(topic, partition)]:
+            synced = append_to_log(log_file, record)
+        # Ack only once the record is on disk
+        wait_for_sync(synced)
         
         # Update metrics
         METRICS["replications"] += 1
         METRICS["topics"][topic]["messages"] += 1
-        METRICS["last_replication"] = time.strftime("%H:%M:%S")
+        METRICS["last_replication"] = _hhmmss()
         add_activity_log("replicate", f"Replicated message for topic '{topic}':p{partition}")
             
         logger.info(f"[{BROKER_ID}] Successfully replicated data to {topic}:p{partition}")
@@ -136,6 +346,88 @@ def handle_replicate():
         logger.error(f"[{BROKER_ID}] Failed to write replicated data: {str(e)}")
         return jsonify({"error": "Failed to save replicated data"}), 500
 
+def parse_replication_frames(body):
+    """
+    Split a framed replication batch into (topic, partition, records) tuples.
+    Each frame is a "<partition> <byte length> <topic as JSON>\\n" header
+    followed by that many bytes of the partition's JSON-line records.
+    """
+    frames = []
+    pos = 0
+    while pos < len(body):
+        header_end = body.index(b"\n", pos)
+        partition, size, topic = body[pos:header_end].split(b" ", 2)
+        start = header_end + 1
+        end = start + int(size)
+        if end > len(body):
+            raise ValueError("truncated replication frame")
+        frames.append((orjson.loads(topic), int(partition), body[start:end]))
+        pos = end
+    return frames
+
+@app.route("/internal/replicate_batch", methods=["POST"])
+def handle_replicate_batch():
+    """
+    Follower-only endpoint for batched replication.
+    The leader sends each partition's records as one length-prefixed frame
+    (older leaders send plain NDJSON), LZ4-compressed when the batch is large;
+    each partition's records are appended to its local log with a single write.
+    """
+    if IS_LEADER:
+        logger.warning(f"[{BROKER_ID}] Received replication batch while being leader. Ignoring.")
+        return jsonify({"error": "I am the leader, not a follower"}), 400
+
+    body = request.get_data()
+    if not body.strip():
+        return jsonify({"error": "No data provided"}), 400
+
+    try:
+        if request.headers.get("Content-Encoding") == "lz4":
+            body = lz4.frame.decompress(body)
+        if request.mimetype == "application/x-yak-batch":
+            frames = parse_replication_frames(body)
+        else:
+            frames = []
+            for line in body.splitlines():
+                if line.strip():
+                    data = orjson.loads(line)
+                    frames.append((data.get("topic"), data.get("partition", 0), line + b"\n"))
+
+        records_by_partition = {}
+        count = 0
+        for topic, partition, records in frames:
+            topic = topic or "default"  # Handle empty strings
+            topic_partitions = ensure_topic_exists(topic)
+            if partition not in topic_partitions:
+                return jsonify({"error": f"Partition {partition} does not exist"}), 400
+
+            # The leader's records are already valid JSON lines, so they are stored as-is
+            records_by_partition.setdefault((topic, partition), []).append(records)
+            messages = records.count(b"\n")
+            METRICS["topics"][topic]["messages"] += messages
+            count += messages
+
+        synced = []
+        for (topic, partition), records in records_by_partition.items():
+            with PARTITION_LOCKS[(topic, partition)]:
+                synced.append(append_to_log(TOPICS[topic][partition], b"".join(records)))
+        # Ack only once every partition's records are on disk
+        wait_for_sync(*synced)
+
+        METRICS["replications"] += count
+        METRICS["last_replication"] = _hhmmss()
+        add_activity_log("replicate", f"Replicated batch of {count} message(s)")
+
+        logger.info(f"[{BROKER_ID}] Successfully replicated batch of {count} message(s)")
+        return jsonify({"status": "ack", "count": count}), 200
+
+    except (ValueError, AttributeError, RuntimeError) as e:
+        logger.error(f"[{BROKER_ID}] Malformed replication batch: {str(e)}")
+        return jsonify({"error": "Malformed replication batch"}), 400
+    except Exception as e:
+        logger.error(f"[{BROKER_ID}] Failed to write replicated batch: {str(e)}")
+        return jsonify({"error": "Failed to save replicated data"}), 500
+
 # --- Dual-Purpose Produce Endpoint ---
 
 @app.route("/produce", methods=["POST"])
@@ -145,6 +437,7 @@ def handle_produce():
     - If NOT leader (follower mode): Rejects the request.
     - If IS leader (promoted mode): Acts as the new leader.
     """
+    global LOCAL_HWM, LOG_INDEX_LIVE
     if not IS_LEADER:
         leader_id = REDIS_CLIENT.get("leader_lease")
         logger.warning(f"[{BROKER_ID}] Received produce request while being a follower. Rejecting.")
@@ -160,12 +453,26 @@ def handle_produce():
     if not data:
         return jsonify({"error": "No data provided"}), 400
         
-    logger.info(f"[{BROKER_ID} (Promoted Leader)] Received produce request: {data}")
+    message = data.get('data')
+    topic = message.get('topic', 'default') if isinstance(message, dict) else 'default'
+    logger.info(f"[{BROKER_ID} (Promoted Leader)] Received produce for topic '{topic}' ({request.content_length} bytes)")
 
     try:
         # --- FIX: Write as proper JSON line ---
-        with open(LOG_FILE, "a") as f:
-            f.write(json.dumps(data) + "\n")
+        record = orjson.dumps(data)
+        with INDEX_LOCK:
+            # Log and index are appended together so their offsets line up
+            synced = append_to_log(LOG_FILE, record + b"\n")
+            LOG_OFFSETS.append(LOG_OFFSETS[-1] + len(record) + 1)
+            if LOG_INDEX_LIVE:
+                try:
+                    append_to_log(LOG_INDEX_FILE, LOG_OFFSETS[-1:].tobytes())
+                except OSError as e:
+                    # The log write stands; a restart rebuilds the index by scanning the log
+                    LOG_INDEX_LIVE = False
+                    logger.warning(f"[{BROKER_ID}] Stopped maintaining {LOG_INDEX_FILE}: {e}")
+        # The HWM only moves, and the producer is only acked, once the record is on disk
+        wait_for_sync(synced)
         
         # Step 2: Replicate to follower (if follower exists)
         if FOLLOWER_URL:
@@ -175,6 +482,13 @@ def handle_produce():
         # Step 3: Commit by advancing HWM.
         new_hwm = REDIS_CLIENT.incr("high_water_mark")
         logger.info(f"[{BROKER_ID} (Promoted Leader)] Successfully wrote. New HWM: {new_hwm}")
+        with LOCAL_HWM_LOCK:
+            # Concurrent produces may finish their INCRs out of order; never move backwards
+            LOCAL_HWM = max(LOCAL_HWM or 0, new_hwm)
+
+        # Wake consumers long-polling for this message
+        with HWM_ADVANCED:
+            HWM_ADVANCED.notify_all()
         
         return jsonify({
             "status": "success",
@@ -188,6 +502,38 @@ def handle_produce():
 
 # --- ADDED: THE MISSING CONSUME ENDPOINT ---
 
+def get_high_water_mark():
+    """Committed HWM; Redis is only read the first time after a promotion."""
+    global LOCAL_HWM
+    if LOCAL_HWM is None:
+        hwm_str = REDIS_CLIENT.get("high_water_mark")
+        with LOCAL_HWM_LOCK:
+            if LOCAL_HWM is None:
+                LOCAL_HWM = int(hwm_str) if hwm_str else 0
+    return LOCAL_HWM
+
+def build_consume_body(start, end, max_bytes):
+    """
+    Build the /consume body for log records [start, end), splicing each raw line from
+    the mmap into its entry.
+    """
+    if start >= end:
+        return b'{"messages":[]}'
+    view = get_log_view(LOG_OFFSETS[end])
+    messages = []
+    batch_bytes = 0
+    for i in range(start, end):
+        # Our HWM is 1-based, so record i has offset i + 1
+        if i + 1 in CORRUPT_OFFSETS:
+            logger.warning(f"Skipping corrupt log line at offset {i + 1}")
+            continue
+        entry = consume_entry(i + 1, view[LOG_OFFSETS[i]:LOG_OFFSETS[i + 1] - 1])
+        messages.append(entry)
+        batch_bytes += len(entry)
+        if max_bytes is not None and batch_bytes >= max_bytes:
+            break
+    return b'{"messages":[' + b",".join(messages) + b"]}"
+
 @app.route("/consume", methods=["GET"])
 def handle_consume():
     """
@@ -201,46 +547,37 @@ def handle_consume():
     try:
         # 1. Get offset from consumer
         offset = int(request.args.get('offset', 0))
+        wait_ms = int(request.args.get('wait_ms', 0))
+        # Optional batch bounds: stop after this many messages / bytes of log
+        max_messages = int(request.args['max']) if 'max' in request.args else None
+        max_bytes = int(request.args['max_bytes']) if 'max_bytes' in request.args else None
     except ValueError:
         return jsonify({"error": "Invalid offset"}), 400
 
     try:
         # 2. Get the High Water Mark (HWM)
-        hwm_str = REDIS_CLIENT.get("high_water_mark")
-        high_water_mark = int(hwm_str) if hwm_str else 0
+        high_water_mark = get_high_water_mark()
+        # Long poll: hold the request until a produce commits past `offset`. When every
+        # slot is taken, answer at once so waiters can't use up the worker threads.
+        if high_water_mark <= offset and wait_ms > 0 and LONG_POLL_SLOTS.acquire(blocking=False):
+            try:
+                with HWM_ADVANCED:
+                    HWM_ADVANCED.wait_for(
+                        lambda: get_high_water_mark() > offset,
+                        timeout=min(wait_ms, MAX_CONSUME_WAIT_MS) / 1000
+                    )
+            finally:
+                LONG_POLL_SLOTS.release()
+            high_water_mark = get_high_water_mark()
         
-        messages = []
-        current_offset = 0 # Log files are 0-indexed
+        # 3. Bound the committed messages after `offset` by what is indexed
+        start = max(offset, 0)
+        end = min(high_water_mark, len(LOG_OFFSETS) - 1)
+        if max_messages is not None:
+            end = min(end, start + max_messages)
 
-        if not os.path.exists(LOG_FILE):
-            logger.info("No log file found, returning empty list.")
-            return jsonify({"messages": []})
-        
-        # 3. Read the log file line by line
-        with open(LOG_FILE, "r") as f:
-            for line in f:
-                # Our HWM is 1-based, so msg_offset is current_offset + 1
-                msg_offset = current_offset + 1
-
-                if msg_offset > high_water_mark:
-                    # We have read all *committed* messages
-                    break 
-                
-                if msg_offset > offset:
-                    # This is a new message the consumer hasn't seen
-                    try:
-                        msg_data = json.loads(line.strip())
-                        messages.append({
-                            "offset": msg_offset,
-                            "data": msg_data
-                        })
-                    except json.JSONDecodeError:
-                        logger.warning(f"Skipping corrupt log line at offset {msg_offset}")
-
-                current_offset += 1
-        
         # 4. Return the messages
-        return jsonify({"messages": messages})
+        return Response(build_consume_body(start, end, max_bytes), mimetype="application/json")
 
     except Exception as e:
         logger.error(f"Error in /consume: {e}")
@@ -300,25 +637,29 @@ def start_lease_renewal():
 
 def attempt_leader_election():
     """Attempt to become the leader by acquiring the leader lease in Redis."""
-    global IS_LEADER
+    global IS_LEADER, LOCAL_HWM
     
     try:
         logger.info(f"[{BROKER_ID}] Attempting leader election...")
         
-        success = REDIS_CLIENT.set(
+        # Claim the lease and read its holder in one round-trip
+        pipe = REDIS_CLIENT.pipeline(transaction=False)
+        pipe.set(
             name="leader_lease",
             value=BROKER_ID,
             ex=LEASE_TIME_SECONDS,
             nx=True  # Only set if not exists
         )
+        pipe.get("leader_lease")
+        success, leader_id = pipe.execute()
         
         if success:
+            LOCAL_HWM = None  # Re-read the committed HWM on first use as leader
             IS_LEADER = True
             logger.info(f"[{BROKER_ID}] *** Successfully became the leader ***")
             start_lease_renewal() 
         else:
             IS_LEADER = False
-            leader_id = REDIS_CLIENT.get("leader_lease")
             logger.info(f"[{BROKER_ID}] Did not win election. Current leader is {leader_id}")
             
     except Exception as e:
@@ -329,21 +670,33 @@ def attempt_leader_election():
 def health():
     """Simple health check endpoint."""
     try:
-        redis_ok = REDIS_CLIENT.ping()
+        # One round-trip for both Redis checks; this is the brokers' discovery probe
+        pipe = REDIS_CLIENT.pipeline(transaction=False)
+        pipe.ping()
+        pipe.get("leader_lease")
+        redis_ok, leader_id = pipe.execute()
         return jsonify({
             "status": "healthy",
             "broker_id": BROKER_ID,
             "is_leader": IS_LEADER,
             "redis_connected": redis_ok,
-            "leader": REDIS_CLIENT.get("leader_lease") or "none"
+            "leader": leader_id or "none"
         })
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
+# dashboard.html has no template variables, so it is rendered once at startup
+with app.app_context():
+    DASHBOARD_HTML = render_template("dashboard.html").encode()
+DASHBOARD_ETAG = generate_etag(DASHBOARD_HTML)
+
 @app.route("/leader", methods=["GET"])
 def leader_dashboard():
     """Serve the broker dashboard UI."""
-    return render_template("dashboard.html")
+    response = Response(DASHBOARD_HTML, mimetype="text/html", headers={"Cache-Control": "public, max-age=60"})
+    response.set_etag(DASHBOARD_ETAG)
+    # Answers 304 Not Modified when the browser already has this version
+    return response.make_conditional(request)
 
 @app.route("/topics", methods=["GET"])
 def list_topics():
@@ -362,11 +715,12 @@ def list_topics():
         logger.error(f"Error listing topics: {e}")
         return jsonify({"error": "Failed to list topics"}), 500
 
-@app.route("/metrics", methods=["GET"])
-def get_metrics():
-    """Return broker metrics for the dashboard."""
+def build_metrics_snapshot():
+    """Encode the /metrics body: (json_bytes, http_status)."""
     try:
-        return jsonify({
+        with METRICS_LOCK:
+            recent_activity = list(itertools.islice(METRICS["recent_activity"], 20))  # Last 20 activities
+        return orjson.dumps({
             "messages_produced": METRICS["messages_produced"],
             "messages_consumed": METRICS["messages_consumed"],
             "replications": METRICS["replications"],
@@ -376,12 +730,29 @@ def get_metrics():
             "follower_health": "N/A",
             "last_replication": METRICS["last_replication"],
             "lease_time_seconds": LEASE_TIME_SECONDS,
-            "recent_activity": METRICS["recent_activity"][:20],
+            "recent_activity": recent_activity,
             "topics": METRICS["topics"]
-        })
+        }), 200
     except Exception as e:
         logger.error(f"Error fetching metrics: {e}")
-        return jsonify({"error": "Failed to fetch metrics"}), 500
+        return orjson.dumps({"error": "Failed to fetch metrics"}), 500
+
+def start_metrics_snapshots():
+    """Start the background thread that rebuilds the /metrics body every SNAPSHOT_INTERVAL_SECONDS."""
+    def _snapshot_loop():
+        global METRICS_SNAPSHOT
+        while True:
+            METRICS_SNAPSHOT = build_metrics_snapshot()
+            time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+
+    threading.Thread(target=_snapshot_loop, daemon=True).start()
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Return broker metrics for the dashboard."""
+    # Built inline until the snapshot thread has run
+    body, status = METRICS_SNAPSHOT or build_metrics_snapshot()
+    return Response(body, status=status, mimetype="application/json")
 
 def start_leader_monitoring():
     """
@@ -414,11 +785,20 @@ def start_leader_monitoring():
     logger.info(f"[{BROKER_ID}] Started leader monitoring thread.")
 
 
-def main():
+def start_background_threads():
+    """Start the log syncer, metrics snapshot and leader monitoring threads (once per serving process)."""
     global IS_LEADER
     IS_LEADER = False # Explicitly start as follower
-    
+
+    start_log_syncer()
+    start_metrics_snapshots()
     start_leader_monitoring()
+
+
+def main():
+    # Development entry point; in production run under gunicorn (see gunicorn_conf.py),
+    # which calls start_background_threads() from its post_worker_init hook.
+    start_background_threads()
     
     logger.info(f"[{BROKER_ID}] Starting follower broker on port {PORT}")
     logger.info(f"[{BROKER_ID}] Monitoring Redis at {REDIS_HOST} for leader lease.")
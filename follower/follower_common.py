@@ -0,0 +1,221 @@
+# Log writer, offset index, replication session and Redis pool shared by the
+# topic-aware followers (follower_with_topics.py, follower_with_topics_partitions.py).
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import time
+import threading
+import logging
+import socket
+import os
+import atexit
+import queue
+import mmap
+from array import array
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+BROKER_ID = f"follower-{socket.gethostname()}"
+LOG_WRITE_BUFFER_BYTES = 1 << 20  # Append handle buffer size
+LOG_WRITER_BATCH_SIZE = 256  # Max lines written per writer wakeup
+LOG_WRITER_LINGER_SECONDS = 0.002  # Extra time to collect more lines per batch
+LOG_WRITE_TIMEOUT_SECONDS = 10  # How long a request waits for its line to reach disk
+
+# Offset index: LOG_INDEX[path][i] is the byte position where message i starts,
+# and the last entry is the end of the last message written. Built by scanning
+# a log once, on first use, then extended by the log writer.
+LOG_INDEX = {}  # {log_file_path: array("Q", [0, end_of_msg_0, end_of_msg_1, ...])}
+LOG_INDEX_LOCK = threading.Lock()
+
+# Appends are queued and written by one writer thread, which batches them into a
+# single write + fdatasync per log, only then extends that log's LOG_INDEX and
+# hands each waiting request its line's offset
+LOG_QUEUE = queue.SimpleQueue()  # items: (log_file_path, line_bytes, Future[offset])
+LOG_FDS = {}  # {log_file_path: append handle}, opened on first write
+LOG_WRITE_LOCK = threading.Lock()  # Serializes the writer thread and the atexit flush
+
+# Keep-alive connections to the follower, reused by every replication call.
+# Only failed connects are retried, so a POST is never sent twice.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=64, max_retries=Retry(total=2, backoff_factor=0.1)))
+REPLICATION_TIMEOUT = (0.2, 1.0)  # (connect, read) seconds for one replication call
+
+
+def connect_redis(host, port, max_connections):
+    """
+    Build the client for the pool shared by request handlers and background threads;
+    keep-alive and periodic health checks keep idle connections usable instead of
+    reconnecting. Requests wait up to 2 s for a free connection.
+    """
+    try:
+        pool = redis.BlockingConnectionPool(
+            host=host, port=port, db=0, decode_responses=True,
+            max_connections=max_connections, timeout=2,
+            socket_keepalive=True, health_check_interval=30
+        )
+        client = redis.Redis(connection_pool=pool)
+        client.ping()
+        logger.info(f"[{BROKER_ID}] Connected to Redis at {host}:{port}")
+        return client
+    except redis.ConnectionError as e:
+        logger.error(f"[{BROKER_ID}] Failed to connect to Redis: {e}")
+        raise
+
+
+def replicate_to_follower(follower_url, record):
+    """POST one record to the follower's /internal/replicate; returns True on ack."""
+    try:
+        response = SESSION.post(f"{follower_url}/internal/replicate", json=record, timeout=REPLICATION_TIMEOUT)
+        if response.status_code == 200:
+            return True
+        logger.warning(f"[{BROKER_ID}] Follower rejected replication: {response.status_code}")
+    except requests.RequestException as e:
+        logger.warning(f"[{BROKER_ID}] Replication to {follower_url} failed: {e}")
+    return False
+
+
+# --- Offset Index Helpers ---
+def get_log_index(log_file):
+    """Return the offset index for a log, scanning the log once on first use."""
+    index = LOG_INDEX.get(log_file)
+    if index is None:
+        with LOG_INDEX_LOCK:
+            index = LOG_INDEX.get(log_file)
+            if index is None:
+                index = array("Q", [0])
+                try:
+                    with open(log_file, "rb") as f:
+                        for line in f:
+                            index.append(index[-1] + len(line))
+                except FileNotFoundError:
+                    pass  # Nothing written yet; the log writer creates the file
+                LOG_INDEX[log_file] = index
+    return index
+
+def read_log_range(log_file, index, first, last):
+    """Yield (position, raw line) for messages [first, last) through a read-only mmap."""
+    if first >= last:
+        return
+    with open(log_file, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(mm, "madvise"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        for i in range(first, last):
+            yield i, mm[index[i]:index[i + 1]]
+    finally:
+        mm.close()
+
+
+# --- Log Writer ---
+# macOS has no fdatasync; fsync gives the same guarantee there
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+def drain_queue(q, limit, linger=0.0):
+    """
+    Block for one item, then take whatever else is already queued (up to limit).
+    With linger > 0, keep collecting for up to that many seconds after the first
+    item so that bursts spread over a few milliseconds still share one batch.
+    """
+    batch = [q.get()]
+    deadline = time.monotonic() + linger
+    while len(batch) < limit:
+        try:
+            remaining = deadline - time.monotonic()
+            batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def discard_log_handle(log_file, length):
+    """Drop a failed log's handle and cut the log back to its last indexed message."""
+    f = LOG_FDS.pop(log_file, None)
+    if f is not None:
+        try:
+            f.close()
+        except Exception:
+            pass  # Whatever close() managed to flush is truncated below
+    try:
+        os.truncate(log_file, length)
+    except OSError as e:
+        logger.error(f"[{BROKER_ID}] Could not truncate {log_file} to {length} bytes: {e}")
+    # Rebuild the index from what is really on disk on the next use
+    with LOG_INDEX_LOCK:
+        LOG_INDEX.pop(log_file, None)
+
+def append_log_lines(log_file, lines):
+    """
+    Append lines to one log and publish them in its index; returns the 1-based offset
+    of the first line. On failure the log is cut back and the error re-raised.
+    """
+    index = get_log_index(log_file)
+    length = index[-1]
+    try:
+        f = LOG_FDS.get(log_file)
+        if f is None:
+            log_dir = os.path.dirname(log_file)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)  # Once per log, not per message
+            f = LOG_FDS[log_file] = open(log_file, "ab", buffering=LOG_WRITE_BUFFER_BYTES)
+        f.write(b"".join(lines))
+        f.flush()
+        fdatasync(f.fileno())
+    except Exception as e:
+        logger.error(f"[{BROKER_ID}] Log writer failed to append {len(lines)} line(s) to {log_file}: {e}")
+        discard_log_handle(log_file, length)
+        raise
+    # Publish the new lines to /consume only once they are on disk
+    with LOG_INDEX_LOCK:
+        first_offset = len(index)
+        for line in lines:
+            index.append(index[-1] + len(line))
+    return first_offset
+
+def write_log_batch(batch):
+    """
+    Append a batch of (log path, line, Future) items: one write and one fdatasync per
+    log. Each Future then gets its line's offset, or the error if its log's append
+    failed (nothing of a failed append is left in the log).
+    """
+    entries_by_file = {}
+    for log_file, line, written in batch:
+        entries_by_file.setdefault(log_file, []).append((line, written))
+    with LOG_WRITE_LOCK:
+        for log_file, entries in entries_by_file.items():
+            try:
+                first_offset = append_log_lines(log_file, [line for line, _ in entries])
+            except Exception as e:
+                for _, written in entries:
+                    written.set_exception(e)
+                continue
+            for i, (_, written) in enumerate(entries):
+                written.set_result(first_offset + i)
+
+def queue_log_line(log_file, line):
+    """Queue one line for the log writer; the Future resolves to its 1-based offset."""
+    written = Future()
+    LOG_QUEUE.put((log_file, line, written))
+    return written
+
+def start_log_writer():
+    """Start the background thread that appends queued lines to their logs."""
+    def _writer_loop():
+        while True:
+            write_log_batch(drain_queue(LOG_QUEUE, LOG_WRITER_BATCH_SIZE, LOG_WRITER_LINGER_SECONDS))
+
+    threading.Thread(target=_writer_loop, daemon=True).start()
+
+def flush_log_queue():
+    """Write out whatever is still queued (registered with atexit)."""
+    batch = []
+    while True:
+        try:
+            batch.append(LOG_QUEUE.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        write_log_batch(batch)
+
+atexit.register(flush_log_queue)
@@ -1,15 +1,26 @@
-import redis 
 import time
 import threading
 import logging
 import socket
-import requests
-import json
+import orjson
+import sys
 import os
+import functools
+import collections
 from flask import Flask, request, jsonify
 
+# Run from the service directory; shared modules live in common/ at the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.orjson_provider import ORJSONProvider
+from follower_common import (
+    LOG_WRITE_TIMEOUT_SECONDS, connect_redis, get_log_index, queue_log_line, read_log_range,
+    replicate_to_follower, start_log_writer,
+)
+
+
 # Initialize Flask app first
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,6 +31,7 @@ BROKER_ID = f"follower-{socket.gethostname()}"
 # This MUST be your ZeroTier IP, since you are hosting Redis
 REDIS_HOST = '192.168.191.242' 
 REDIS_PORT = 6379
+REDIS_MAX_CONNECTIONS = 64  # Redis pool size; requests wait up to 2 s for a free connection
 PORT = 5002
 FOLLOWER_URL = None 
 
@@ -36,40 +48,58 @@ RENEW_INTERVAL_SECONDS = 5
 IS_LEADER = False
 LEASE_RENEWAL_THREAD = None
 
+# Committed HWM per topic. Only the leader advances "topic_hwm" and only the leader
+# serves /consume, so each topic is read from Redis once per promotion and then kept
+# current by handle_produce.
+HWM_CACHE = {}  # {topic: high_water_mark}
+HWM_LOCK = threading.Lock()
+
+# One lock per topic: a produce appends its line and advances the topic HWM under it,
+# so HWM increments follow the order lines land in the log
+TOPIC_LOCKS = collections.defaultdict(threading.Lock)
+
 # Initialize Redis client
-try:
-    REDIS_CLIENT = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-    REDIS_CLIENT.ping()
-    logger.info(f"[{BROKER_ID}] Successfully connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
-except redis.ConnectionError as e:
-    logger.error(f"[{BROKER_ID}] Failed to connect to Redis: {e}")
-    raise
+REDIS_CLIENT = connect_redis(REDIS_HOST, REDIS_PORT, REDIS_MAX_CONNECTIONS)
+
+def get_high_water_mark(topic):
+    """Committed HWM for a topic; Redis is only read the first time after a promotion."""
+    high_water_mark = HWM_CACHE.get(topic)
+    if high_water_mark is None:
+        hwm_str = REDIS_CLIENT.hget("topic_hwm", topic)
+        # setdefault: never overwrite a newer value a produce stored meanwhile
+        high_water_mark = HWM_CACHE.setdefault(topic, int(hwm_str) if hwm_str else 0)
+    return high_water_mark
+
 
 # --- Helper Function for Topic-Based Logging ---
-def write_to_topic_log(message_data):
+@functools.lru_cache(maxsize=1024)
+def topic_log_path(topic):
+    """Path of a topic's log file (memoized; built once per topic)."""
+    return os.path.join(LOG_DIR, f"{topic}.log")
+
+def message_topic(message_data):
     """
-    Extracts the topic from a message and writes it to a topic-specific log file.
+    Extracts the topic from a message.
     'message_data' is expected to be the dict: {'topic': ..., 'key': ..., 'payload': ...}
     """
-    
-    # 1. Determine topic
     if not isinstance(message_data, dict) or 'topic' not in message_data:
         logger.warning(f"Message format error, using 'default' topic. Data: {message_data}")
-        topic = "default"
-    else:
-        topic = message_data.get('topic')
+        return "default"
+    return message_data.get('topic')
 
-    # 2. Ensure log directory exists
-    os.makedirs(LOG_DIR, exist_ok=True)
-    
-    # 3. Define file path and write to log
-    log_file_path = os.path.join(LOG_DIR, f"{topic}.log")
+def write_to_topic_log(topic, message_data):
+    """
+    Appends a message to its topic's log file and returns the log path once the
+    log writer has it on disk (raises if the append failed).
+    """
+    # The log writer creates LOG_DIR
+    log_file_path = topic_log_path(topic)
     
-    with open(log_file_path, "a") as f:
-        # Write the full message (including topic/key) as a single JSON line
-        f.write(json.dumps(message_data) + "\n")
+    # Queue the full message (including topic/key) as a single JSON line
+    line = orjson.dumps(message_data, option=orjson.OPT_APPEND_NEWLINE)
+    queue_log_line(log_file_path, line).result(timeout=LOG_WRITE_TIMEOUT_SECONDS)
         
-    return topic, log_file_path
+    return log_file_path
 
 
 # --- Follower's Replication Endpoint (MODIFIED) ---
@@ -92,8 +122,9 @@ def handle_replicate():
         # The 'data' part is what we care about: {'topic': ..., 'key': ..., 'payload': ...}
         message_to_log = data.get('data')
         
-        # --- MODIFIED: Use the topic-based write function ---
-        topic, log_file = write_to_topic_log(message_to_log)
+        # --- MODIFIED: Use the topic-based write function (acked once on disk) ---
+        topic = message_topic(message_to_log)
+        log_file = write_to_topic_log(topic, message_to_log)
             
         logger.info(f"[{BROKER_ID}] Successfully replicated data to topic '{topic}' (File: {log_file})")
         return jsonify({"status": "ack"}), 200
@@ -128,23 +159,27 @@ def handle_produce():
     if not data:
         return jsonify({"error": "No data provided"}), 400
         
-    logger.info(f"[{BROKER_ID} (Promoted Leader)] Received produce request: {data}")
-
     try:
         # The 'data' part is what we care about
         message_to_log = data.get('data')
 
-        # --- MODIFIED: Step 1: Write to local topic log ---
-        topic, log_file = write_to_topic_log(message_to_log)
-        
-        # Step 2: Replicate to follower (if follower exists)
+        topic = message_topic(message_to_log)
+        logger.info(f"[{BROKER_ID} (Promoted Leader)] Received produce for topic '{topic}' ({request.content_length} bytes)")
+
+        with TOPIC_LOCKS[topic]:
+            # --- MODIFIED: Step 1: Write to local topic log, waiting until it is on disk ---
+            write_to_topic_log(topic, message_to_log)
+
+            # --- MODIFIED: Step 2: Commit by advancing topic-specific HWM ---
+            # We use a Redis Hash 'topic_hwm' to store offsets per topic. The HWM only
+            # moves past lines that are on disk, in the order they were appended.
+            new_topic_hwm = REDIS_CLIENT.hincrby("topic_hwm", topic, 1)
+            with HWM_LOCK:
+                HWM_CACHE[topic] = max(HWM_CACHE.get(topic, 0), new_topic_hwm)
+
+        # Step 3: Replicate to follower (if follower exists)
         if FOLLOWER_URL:
-            # ... (replication logic would go here) ...
-            pass
-        
-        # --- MODIFIED: Step 3: Commit by advancing topic-specific HWM ---
-        # We use a Redis Hash 'topic_hwm' to store offsets per topic
-        new_topic_hwm = REDIS_CLIENT.hincrby("topic_hwm", topic, 1)
+            replicate_to_follower(FOLLOWER_URL, {"data": message_to_log})
         
         logger.info(f"[{BROKER_ID} (Promoted Leader)] Successfully wrote to topic '{topic}'. New HWM: {new_topic_hwm}")
         
@@ -185,42 +220,31 @@ def handle_consume():
 
     try:
         # --- MODIFIED: 2. Get the High Water Mark (HWM) for this topic ---
-        hwm_str = REDIS_CLIENT.hget("topic_hwm", topic)
-        high_water_mark = int(hwm_str) if hwm_str else 0
+        high_water_mark = get_high_water_mark(topic)
         
         messages = []
-        current_offset = 0 # Log files are 0-indexed
 
         # --- MODIFIED: 3. Construct log path ---
-        log_file_path = os.path.join(LOG_DIR, f"{topic}.log")
+        log_file_path = topic_log_path(topic)
 
-        if not os.path.exists(log_file_path):
+        # The offset index answers "is there a log?" without a stat per request
+        index = get_log_index(log_file_path)
+        if len(index) == 1:
             logger.info(f"No log file found for topic '{topic}', returning empty list.")
             return jsonify({"messages": [], "latest_offset": high_water_mark})
         
-        # 4. Read the correct log file line by line
-        with open(log_file_path, "r") as f:
-            for line in f:
-                # Our HWM is 1-based, so msg_offset is current_offset + 1
-                msg_offset = current_offset + 1
-
-                if msg_offset > high_water_mark:
-                    # We have read all *committed* messages for this topic
-                    break 
-                
-                if msg_offset > offset:
-                    # This is a new message the consumer hasn't seen
-                    try:
-                        msg_data = json.loads(line.strip())
-                        messages.append({
-                            "offset": msg_offset,
-                            # The 'data' is the full message: {'topic':..., 'key':..., 'payload':...}
-                            "data": msg_data 
-                        })
-                    except json.JSONDecodeError:
-                        logger.warning(f"Skipping corrupt log line in {topic}.log at offset {msg_offset}")
-
-                current_offset += 1
+        # 4. Slice the committed messages after `offset` straight out of the log.
+        # Our HWM is 1-based, so the message at index i has offset i + 1
+        last = min(high_water_mark, len(index) - 1)
+        for i, line in read_log_range(log_file_path, index, max(offset, 0), last):
+            try:
+                messages.append({
+                    "offset": i + 1,
+                    # The 'data' is the full message: {'topic':..., 'key':..., 'payload':...}
+                    "data": orjson.loads(line)
+                })
+            except orjson.JSONDecodeError:
+                logger.warning(f"Skipping corrupt log line in {topic}.log at offset {i + 1}")
         
         # 5. Return the messages
         return jsonify({"messages": messages, "latest_offset": high_water_mark})
@@ -297,6 +321,7 @@ def attempt_leader_election():
         )
         
         if success:
+            HWM_CACHE.clear()  # Re-read committed HWMs on first use as leader
             IS_LEADER = True
             logger.info(f"[{BROKER_ID}] *** Successfully became the leader ***")
             start_lease_renewal() 
@@ -355,14 +380,22 @@ def start_leader_monitoring():
     logger.info(f"[{BROKER_ID}] Started leader monitoring thread.")
 
 
-def main():
+def start_background_threads():
+    """Start the log writer and leader monitoring threads (once per serving process)."""
     global IS_LEADER
     IS_LEADER = False # Explicitly start as follower
     
     # Ensure log directory exists on startup
     os.makedirs(LOG_DIR, exist_ok=True) 
 
+    start_log_writer()
     start_leader_monitoring()
+
+
+def main():
+    # Development entry point; in production run under gunicorn (see gunicorn_conf.py),
+    # which calls start_background_threads() from its post_worker_init hook.
+    start_background_threads()
     
     logger.info(f"[{BROKER_ID}] Starting follower broker on port {PORT}")
     logger.info(f"[{BROKER_ID}] Log directory: {os.path.abspath(LOG_DIR)}")
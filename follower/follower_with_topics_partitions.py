@@ -1,21 +1,33 @@
-import redis
-import requests
 import time
 import threading
 import logging
 import socket
-import json
+import sys
 import os
+import orjson
+import zlib
 import uuid
+import collections
 from flask import Flask, request, jsonify, render_template
 
+# Run from the service directory; shared modules live in common/ at the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.orjson_provider import ORJSONProvider
+from follower_common import (
+    LOG_WRITE_TIMEOUT_SECONDS, connect_redis, get_log_index, queue_log_line, read_log_range,
+    replicate_to_follower, start_log_writer,
+)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # ---------------- CONFIG (MODIFIED FOR FOLLOWER) ----------------
 FOLLOWER_URL = None
 BROKER_ID = f"follower-{socket.gethostname()}"
 REDIS_HOST = "192.168.191.242" 
 REDIS_PORT = 6379
+REDIS_MAX_CONNECTIONS = 64  # Redis pool size; requests wait up to 2 s for a free connection
 LEASE_TIME_SECONDS = 10
 RENEW_INTERVAL_SECONDS = 5
 PORT = 5002
@@ -40,8 +52,27 @@ METRICS = {
     "recent_activity": [], "topics": {}
 }
 
+# Committed HWM per partition. Only the leader advances the "hwm:*" keys and only the
+# leader serves /consume, so each partition is read from Redis once per promotion and
+# then kept current by handle_produce.
+HWM_CACHE = {}  # {(topic, partition_id): high_water_mark}
+
+# One lock per (topic, partition): a produce checks its msg_id, appends its line and
+# commits its offset under it, so each partition's HWM follows its log in order
+PARTITION_LOCKS = collections.defaultdict(threading.Lock)
+
+# [second, "HH:MM:SS"] - dashboard timestamps only change once a second
+_TS_CACHE = [0, ""]
+
+def _hhmmss():
+    now = int(time.time())
+    if now != _TS_CACHE[0]:
+        _TS_CACHE[1] = time.strftime("%H:%M:%S", time.localtime(now))
+        _TS_CACHE[0] = now
+    return _TS_CACHE[1]
+
 def add_activity_log(log_type, message):
-    timestamp = time.strftime("%H:%M:%S")
+    timestamp = _hhmmss()
     METRICS["recent_activity"].insert(0, {
         "type": log_type, "message": message, "timestamp": timestamp
     })
@@ -51,7 +82,8 @@ def add_activity_log(log_type, message):
 def get_partition_for_key(key, num_partitions):
     if key is None:
         return 0
-    return hash(key) % num_partitions
+    # CRC32 is stable across restarts (hash() of str is salted per process)
+    return zlib.crc32(key if isinstance(key, bytes) else str(key).encode()) % num_partitions
 
 def ensure_topic_exists(topic_name, num_partitions=DEFAULT_PARTITIONS):
     if topic_name not in TOPICS:
@@ -67,14 +99,33 @@ def ensure_topic_exists(topic_name, num_partitions=DEFAULT_PARTITIONS):
         add_activity_log("topic", f"Ensured topic '{topic_name}' with {num_partitions} partitions")
     return TOPICS[topic_name]
 
+def get_high_water_mark(topic, partition):
+    """Committed HWM for a partition; Redis is only read the first time after a promotion."""
+    high_water_mark = HWM_CACHE.get((topic, partition))
+    if high_water_mark is None:
+        hwm_str = REDIS_CLIENT.get(f"hwm:{topic}:{partition}")
+        # setdefault: never overwrite a newer value a produce stored meanwhile
+        high_water_mark = HWM_CACHE.setdefault((topic, partition), int(hwm_str) if hwm_str else 0)
+    return high_water_mark
+
+def append_to_log(log_file, record):
+    """Append one record as a JSON line and wait until it is on disk; returns its offset."""
+    line = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+    return queue_log_line(log_file, line).result(timeout=LOG_WRITE_TIMEOUT_SECONDS)
+
 # ---------------- REDIS INIT ----------------
-try:
-    REDIS_CLIENT = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-    REDIS_CLIENT.ping()
-    logger.info(f"[{BROKER_ID}] Connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
-except redis.ConnectionError as e:
-    logger.error(f"[{BROKER_ID}] Failed to connect to Redis: {e}")
-    raise
+REDIS_CLIENT = connect_redis(REDIS_HOST, REDIS_PORT, REDIS_MAX_CONNECTIONS)
+
+# Claim + commit in one round trip, run once the line is on disk: claim the msg_id
+# (SET NX EX) and, only if it was new, raise the partition HWM to the line's offset
+# (ARGV[2]). Returns that offset, or 0 for a duplicate.
+# redis-py runs this via EVALSHA and reloads the script on NOSCRIPT.
+CLAIM_AND_COMMIT_SCRIPT = REDIS_CLIENT.register_script(
+    "if redis.call('SET', KEYS[1], 'processed', 'EX', ARGV[1], 'NX') then "
+    "local offset = tonumber(ARGV[2]) "
+    "if offset > tonumber(redis.call('GET', KEYS[2]) or '0') then redis.call('SET', KEYS[2], offset) end "
+    "return offset else return 0 end"
+)
 
 # ---------------- ROUTES ----------------
 
@@ -110,13 +161,12 @@ def handle_replicate():
             logger.error(f"[{BROKER_ID}] Leader tried to replicate to non-existent partition {partition_id}")
             return jsonify({"error": "Invalid partition"}), 400
             
-        # Write to follower's local partition log
-        with open(log_file, "a") as f:
-            f.write(json.dumps(data) + "\n")
+        # Write to the local partition log; the ack is sent only once it is on disk
+        append_to_log(log_file, data)
             
         logger.info(f"[{BROKER_ID}] Replicated to {topic}:p{partition_id}")
         METRICS["replications_received"] += 1
-        METRICS["last_replication"] = time.strftime("%H:%M:%S")
+        METRICS["last_replication"] = _hhmmss()
         add_activity_log("replicate", f"Data received for {topic}:p{partition_id}")
         
         return jsonify({"status": "ack"}), 200
@@ -157,32 +207,7 @@ def handle_produce():
     
     logger.info(f"[{BROKER_ID} (Promoted)] Received produce for topic '{topic}' (MsgID: {msg_id})")
 
-    # <-- NEW BLOCK: Idempotence Check using Redis
-    # We create a unique key for this message ID.
-    # 'nx=True' means "set only if it does not exist"
-    # 'ex=...' means "expire after N seconds"
     idempotence_key = f"yak_msg_lock:{msg_id}"
-    is_new_message = REDIS_CLIENT.set(
-        idempotence_key, 
-        "processed", 
-        ex=IDEMPOTENCE_EXPIRY_SECONDS, 
-        nx=True
-    )
-
-    if not is_new_message:
-        # This message ID has been seen before.
-        logger.warning(f"[{BROKER_ID} (Promoted)] Duplicate message detected (MsgID: {msg_id}). Ignoring.")
-        # Return 200 OK so the producer thinks it succeeded
-        return jsonify({
-            "status": "success_duplicate", 
-            "msg_id": msg_id,
-            "leader_id": BROKER_ID
-        }), 200
-    # --- End of Idempotence Check ---
-
-    METRICS["messages_produced"] += 1
-    add_activity_log("produce", f"Message received for topic '{topic}'")
-
     try:
         topic_partitions = ensure_topic_exists(topic)
         partition_id = get_partition_for_key(key, len(topic_partitions))
@@ -193,32 +218,66 @@ def handle_produce():
             "topic": topic, "partition": partition_id, "key": key,
             "payload": payload, "timestamp": time.time()
         }
-        
-        with open(log_file, "a") as f:
-            f.write(json.dumps(message) + "\n")
-        
-        METRICS["topics"][topic]["messages"] += 1
-
-        # FOLLOWER_URL is None, so replication is skipped
-        if FOLLOWER_URL:
-            pass
-
-        # Commit (update HWM)
-        hwm_key = f"hwm:{topic}:{partition_id}"
-        new_hwm = REDIS_CLIENT.incr(hwm_key)
-        logger.info(f"[{BROKER_ID} (Promoted)] Commit. {topic}:p{partition_id}, HWM: {new_hwm}")
+        line = orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE)
+    except Exception as e:
+        # Nothing has been claimed yet, so the producer may simply retry
+        logger.error(f"[{BROKER_ID} (Promoted)] Failed to process produce: {e}")
+        return jsonify({"error": "Internal error"}), 500
 
+    # The line is appended and fdatasynced before its offset is committed, so the HWM
+    # and the producer's ack only ever name offsets that exist in the log. Offsets are
+    # log positions: a failed append is cut back out and never shifts later records.
+    hwm_key = f"hwm:{topic}:{partition_id}"
+    with PARTITION_LOCKS[(topic, partition_id)]:
+        offset = new_hwm = 0
+        try:
+            # A retried msg_id carries the same key, so it lands on this partition and
+            # this lock; a duplicate is therefore never appended while the first is in flight
+            if not REDIS_CLIENT.exists(idempotence_key):
+                offset = queue_log_line(log_file, line).result(timeout=LOG_WRITE_TIMEOUT_SECONDS)
+        except Exception as e:
+            # Nothing was claimed or committed, so the producer may simply retry
+            logger.error(f"[{BROKER_ID} (Promoted)] Failed to append MsgID {msg_id}: {e}")
+            return jsonify({"error": "Internal error"}), 500
+        if offset:
+            try:
+                new_hwm = CLAIM_AND_COMMIT_SCRIPT(
+                    keys=[idempotence_key, hwm_key], args=[IDEMPOTENCE_EXPIRY_SECONDS, offset]
+                )
+            except Exception as e:
+                # The line is on disk and the script may have claimed the msg_id before
+                # failing. The next commit on this partition covers the offset either way;
+                # a retry could append the message twice, so tell the producer not to.
+                logger.error(f"[{BROKER_ID} (Promoted)] Commit failed for MsgID {msg_id}: {e}")
+                return jsonify({"error": "Commit outcome unknown; do not retry this msg_id", "msg_id": msg_id}), 500
+            if new_hwm:
+                HWM_CACHE[(topic, partition_id)] = max(HWM_CACHE.get((topic, partition_id), 0), new_hwm)
+
+    if not new_hwm:
+        # This message ID has been seen before.
+        logger.warning(f"[{BROKER_ID} (Promoted)] Duplicate message detected (MsgID: {msg_id}). Ignoring.")
+        # Return 200 OK so the producer thinks it succeeded
         return jsonify({
-            "status": "success_new", # <-- CHANGED: Be explicit this was a new message
-            "offset": new_hwm, "topic": topic,
-            "partition": partition_id, "leader_id": BROKER_ID
+            "status": "success_duplicate", 
+            "msg_id": msg_id,
+            "leader_id": BROKER_ID
         }), 200
 
-    except Exception as e:
-        logger.error(f"[{BROKER_ID} (Promoted)] Failed to process produce: {e}")
-        # <-- NEW BLOCK: If we fail, we should clear the idempotence key so it can be retried
-        REDIS_CLIENT.delete(idempotence_key)
-        return jsonify({"error": "Internal error"}), 500
+    # FOLLOWER_URL is None, so replication is skipped. Runs after the idempotence
+    # check so a retried duplicate is never sent to the follower twice.
+    if FOLLOWER_URL:
+        replicate_to_follower(FOLLOWER_URL, message)
+
+    METRICS["messages_produced"] += 1
+    METRICS["topics"][topic]["messages"] += 1
+    add_activity_log("produce", f"Message received for topic '{topic}'")
+    logger.info(f"[{BROKER_ID} (Promoted)] Commit. {topic}:p{partition_id}, HWM: {new_hwm}")
+
+    return jsonify({
+        "status": "success_new", # <-- CHANGED: Be explicit this was a new message
+        "offset": new_hwm, "topic": topic,
+        "partition": partition_id, "leader_id": BROKER_ID
+    }), 200
 
 # --- ALL OTHER ENDPOINTS ARE IDENTICAL TO LEADER ---
 # (No changes to the functions below)
@@ -254,32 +313,25 @@ def handle_consume():
         
         log_file = TOPICS[topic][partition]
         
-        hwm_key = f"hwm:{topic}:{partition}"
-        hwm_str = REDIS_CLIENT.get(hwm_key)
-        high_water_mark = int(hwm_str) if hwm_str else 0
+        high_water_mark = get_high_water_mark(topic, partition)
         
         messages = []
-        current_offset = 0 
-        if not os.path.exists(log_file):
+        # The offset index answers "is there a log?" without a stat per request
+        index = get_log_index(log_file)
+        if len(index) == 1:
             return jsonify({"messages": []})
         
-        with open(log_file, "r") as f:
-            for line in f:
-                msg_offset = current_offset + 1
-                if msg_offset > high_water_mark:
-                    break 
-                
-                # <-- THIS IS THE FIX FROM THE FIRST PROBLEM
-                if msg_offset >= offset: 
-                    try:
-                        msg_data = json.loads(line.strip())
-                        messages.append({
-                            "offset": msg_offset, "topic": topic,
-                            "partition": partition, "data": msg_data
-                        })
-                    except json.JSONDecodeError:
-                        logger.warning(f"Skipping corrupt log line at offset {msg_offset}")
-                current_offset += 1
+        # Slice messages from `offset` (inclusive) up to the HWM straight out of the log.
+        # Our HWM is 1-based, so the message at index i has offset i + 1
+        last = min(high_water_mark, len(index) - 1)
+        for i, line in read_log_range(log_file, index, max(offset - 1, 0), last):
+            try:
+                messages.append({
+                    "offset": i + 1, "topic": topic,
+                    "partition": partition, "data": orjson.loads(line)
+                })
+            except orjson.JSONDecodeError:
+                logger.warning(f"Skipping corrupt log line at offset {i + 1}")
         
         METRICS["messages_consumed"] += len(messages)
         if messages:
@@ -368,6 +420,7 @@ def attempt_leader_election():
         logger.info(f"[{BROKER_ID}] Attempting leader election...")
         success = REDIS_CLIENT.set("leader_lease", BROKER_ID, ex=LEASE_TIME_SECONDS, nx=True)
         if success:
+            HWM_CACHE.clear()  # Re-read committed HWMs on first use as leader
             IS_LEADER = True
             logger.info(f"[{BROKER_ID}] Became the leader 🏆")
             METRICS["elections_won"] += 1
@@ -392,6 +445,7 @@ def watch_leader_status():
                 attempt_leader_election()
             elif current == BROKER_ID and not IS_LEADER:
                 logger.info(f"[{BROKER_ID}] Regained leadership unexpectedly.")
+                HWM_CACHE.clear()
                 IS_LEADER = True
                 start_lease_renewal()
             elif current != BROKER_ID and IS_LEADER:
@@ -404,8 +458,15 @@ def watch_leader_status():
             time.sleep(3)
 
 # ---------------- MAIN (MODIFIED FOR FOLLOWER) ----------------
-def main():
+def start_background_threads():
+    """Start the log writer and leader watch threads (once per serving process)."""
+    start_log_writer()
     threading.Thread(target=watch_leader_status, daemon=True).start()
+
+def main():
+    # Development entry point; in production run under gunicorn (see gunicorn_conf.py),
+    # which calls start_background_threads() from its post_worker_init hook.
+    start_background_threads()
     
     logger.info(f"[{BROKER_ID}] Follower broker starting on port {PORT}")
     logger.info(f"[{BROKER_ID}] Monitoring leader: {REDIS_CLIENT.get('leader_lease') or 'None'}")
@@ -0,0 +1,30 @@
+# Gunicorn settings for the follower.
+# Run from the follower/ directory with:
+#   gunicorn -c gunicorn_conf.py follower:app
+# The topic-aware variants are served the same way, e.g.
+#   gunicorn -c gunicorn_conf.py follower_with_topics_partitions:app
+import sys
+
+bind = "0.0.0.0:5002"
+
+# Threaded workers: requests waiting on Redis or in a /consume long poll each hold a
+# thread, while the log flusher's fsyncs block only their own thread.
+# At most follower.MAX_LONG_POLLS (16) /consume requests wait at once, each for up to
+# MAX_CONSUME_WAIT_MS (5 s); further subscribers get an immediate reply instead.
+# That leaves 16 threads for /produce, /internal/replicate and /health. To serve more
+# UI subscriptions, raise MAX_LONG_POLLS and threads together.
+worker_class = "gthread"
+threads = 32
+
+# Producers and consumers reuse HTTP sessions between polls; keep their
+# connections open instead of re-handshaking after gunicorn's 2 s default.
+keepalive = 30
+
+# The message/offset indexes, open log handles and leadership state live in
+# process memory, so the follower must be served by exactly one worker process.
+workers = 1
+
+
+def post_worker_init(worker):
+    follower = sys.modules[worker.wsgi.import_name]
+    follower.start_background_threads()